@@ -1,8 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import (Blueprint, Flask, Response, abort, current_app, render_template, request, redirect, url_for, flash,
+                   session, jsonify, make_response, send_file, stream_with_context, has_app_context,
+                   has_request_context, g)
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from markupsafe import Markup
+from sqlalchemy import and_, event, func, inspect, or_, select, text, union_all
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.schema import CreateTable, DropTable
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session, aliased, joinedload, make_transient_to_detached, selectinload
+from datetime import datetime, timedelta
+import click
+from cache import MISSING, DatabaseCache, TieredCache, TTLCache
+from config import Config
+from events import Broker, DatabaseBackend, LocalBackend, format_sse
+from jobs import ArtifactCache, Job, JobQueue, QueueFull
+from passwords import PasswordHasher
+from settlement_engine import plan_settlements
+from writes import WriteCoalescer
+import metrics
+from metrics import timed
 import string
 import random
 import os
@@ -14,16 +32,28 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 import io
+import time
+import csv
+import json
+import functools
+import re
+import hashlib
+import heapq
+import itertools
+import base64
+import binascii
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///splitly.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
+db = SQLAlchemy()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
+
+main = Blueprint('main', __name__, cli_group=None)
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+# API clients get a 401 instead of a redirect to the login page
+login_manager.blueprint_login_views['api'] = None
+
+API_GROUP_FIELDS = ('id', 'name', 'version', 'expense_count', 'total_spent', 'members', 'balances', 'settlements')
+API_DEFAULT_FIELDS = ('id', 'name', 'balances', 'settlements')
 
 from flask_login import UserMixin
 from datetime import datetime
@@ -45,6 +75,13 @@ class Group(db.Model):
     code = db.Column(db.String(6), unique=True, nullable=False)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every expense, settlement and membership write; keys cached
+    # artifacts such as reports and the ETags of group pages
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Running totals kept in step with the ledger so summaries don't scan expenses
+    expense_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_spent = db.Column(db.Float, nullable=False, default=0, server_default='0')
     
     creator = db.relationship('User', backref='created_groups')
     
@@ -59,6 +96,11 @@ class GroupMember(db.Model):
     
     group = db.relationship('Group', backref='members')
     user = db.relationship('User', backref='group_memberships')
+    
+    __table_args__ = (
+        db.Index('ix_group_member_group_user', 'group_id', 'user_id'),
+        db.Index('ix_group_member_user_group', 'user_id', 'group_id'),
+    )
 
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -66,15 +108,37 @@ class Expense(db.Model):
     description = db.Column(db.String(200), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     paid_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    split_members = db.Column(db.Text, nullable=False)  # Comma-separated user IDs
+    split_members = db.Column(db.Text, nullable=False)  # Comma-separated user IDs, superseded by shares
     date = db.Column(db.DateTime, default=datetime.utcnow)
     
     group = db.relationship('Group', backref='expenses')
     payer = db.relationship('User', backref='paid_expenses')
+    shares = db.relationship('ExpenseShare', backref='expense', cascade='all, delete-orphan',
+                             order_by='ExpenseShare.id')
+    
+    # AUTOINCREMENT so SQLite never hands out the ids of archived rows again;
+    # checkpoints and archiving rely on ids only going up
+    __table_args__ = (
+        db.Index('ix_expense_group_date_id', 'group_id', 'date', 'id'),
+        {'sqlite_autoincrement': True},
+    )
     
     def __repr__(self):
         return f'<Expense {self.description}:  {self.amount}>'
 
+class ExpenseShare(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    share_amount = db.Column(db.Float, nullable=False)
+    
+    user = db.relationship('User', backref='expense_shares')
+    
+    __table_args__ = (
+        db.Index('ix_expense_share_user_expense', 'user_id', 'expense_id'),
+        {'sqlite_autoincrement': True},
+    )
+
 class Settlement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
@@ -84,12 +148,337 @@ class Settlement(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow)
     
     group = db.relationship('Group', backref='settlements')
+    
+    __table_args__ = (
+        db.Index('ix_settlement_group_date', 'group_id', 'date'),
+        {'sqlite_autoincrement': True},
+    )
     from_user_obj = db.relationship('User', foreign_keys=[from_user], backref='settlements_made')
     to_user_obj = db.relationship('User', foreign_keys=[to_user], backref='settlements_received')
 
+class MemberBalance(db.Model):
+    """Materialized balance of one member in one group, updated on every write"""
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    balance = db.Column(db.Float, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'user_id', name='uq_member_balance_group_user'),
+    )
+
+class PairwiseBalance(db.Model):
+    """What ``counterparty_id`` owes ``user_id`` in one group, net of everything between them.
+    
+    Every pair is stored from both sides with opposite signs, so a user's
+    position against everyone they share a group with is one range of
+    ix_pairwise_balance_user. A member's rows add up to their MemberBalance.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    counterparty_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'user_id', 'counterparty_id', name='uq_pairwise_balance_group_pair'),
+        db.Index('ix_pairwise_balance_user', 'user_id', 'counterparty_id', 'group_id', 'amount'),
+    )
+
+class MonthlyRollup(db.Model):
+    """Per group, member and month totals, kept in step with every write.
+    
+    ``paid`` is what the member paid for expenses and ``owed`` their share
+    of them; ``settled_out``/``settled_in`` are settlements paid/received.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # 'YYYY-MM'
+    paid = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    owed = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    settled_out = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    settled_in = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    expense_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'month', 'user_id', name='uq_monthly_rollup_group_month_user'),
+        db.Index('ix_monthly_rollup_user_month', 'user_id', 'month'),
+    )
+
+ROLLUP_FIELDS = ('paid', 'owed', 'settled_out', 'settled_in', 'expense_count')
+
+class BalanceCheckpoint(db.Model):
+    """Member balances of a group as of an expense id and a settlement id.
+    
+    Replays start from the latest checkpoint, and the history it covers can
+    be moved to the archive tables. Covered expenses can no longer be deleted.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    expense_id = db.Column(db.Integer, nullable=False, default=0)  # covers ids up to and including these
+    settlement_id = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    archived_at = db.Column(db.DateTime)
+    
+    balances = db.relationship('CheckpointBalance', backref='checkpoint', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_balance_checkpoint_group_id', 'group_id', 'id'),
+    )
+
+class CheckpointBalance(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    checkpoint_id = db.Column(db.Integer, db.ForeignKey('balance_checkpoint.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    balance = db.Column(db.Float, nullable=False)
+
+# Cold copies of expense, expense_share and settlement for checkpointed history.
+# Rows keep their ids; only exports, the PDF and rebuilds read them.
+class ArchivedExpense(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    description = db.Column(db.String(200), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    paid_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    split_members = db.Column(db.Text, nullable=False)
+    date = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_archived_expense_group_date_id', 'group_id', 'date', 'id'),
+    )
+
+class ArchivedExpenseShare(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    expense_id = db.Column(db.Integer, db.ForeignKey('archived_expense.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    share_amount = db.Column(db.Float, nullable=False)
+
+class ArchivedSettlement(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    from_user = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    to_user = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    date = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_archived_settlement_group_date', 'group_id', 'date'),
+    )
+
+HOT_HISTORY = (Expense, ExpenseShare, Settlement)
+ARCHIVED_HISTORY = (ArchivedExpense, ArchivedExpenseShare, ArchivedSettlement)
+
+class IdempotencyKey(db.Model):
+    """The response first sent for a client's Idempotency-Key, replayed on retries"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    endpoint = db.Column(db.String(64), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of the request body
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+    )
+
+class GroupEvent(db.Model):
+    """Outbox read by DatabaseBackend to relay live events between processes"""
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False, index=True)
+
+class FragmentCacheEntry(db.Model):
+    """Rendered fragments shared between processes when FRAGMENT_CACHE_BACKEND is 'database'"""
+    __tablename__ = 'fragment_cache'
+    key = db.Column(db.String(128), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """Load the session user, from the user cache when possible"""
+    user_id = int(user_id)
+    cache = current_app.extensions['user_cache']
+    values = cache.get(user_id)
+    if values is MISSING:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            cache.set(user_id, {column.key: getattr(user, column.key) for column in User.__table__.columns})
+        return user
+    
+    # Rebuild the row from cached values and attach it without a SELECT
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def is_group_member(group_id, user_id=None):
+    """Whether ``user_id`` (the current user by default) belongs to the group.
+    
+    Answers are memoized for the request and cached across requests;
+    join_group and leave_group invalidate the cached entry.
+    """
+    key = (current_user.id if user_id is None else user_id, group_id)
+    memo = g.setdefault('memberships', {})
+    if key not in memo:
+        cache = current_app.extensions['membership_cache']
+        member = cache.get(key)
+        if member is MISSING:
+            member = db.session.query(GroupMember.query.filter_by(
+                user_id=key[0], group_id=group_id
+            ).exists()).scalar()
+            cache.set(key, member)
+        memo[key] = member
+    return memo[key]
+
+def invalidate_membership(group_id, user_id):
+    current_app.extensions['membership_cache'].invalidate((user_id, group_id))
+    g.pop('memberships', None)
+
+def membership_denied():
+    if request.method == 'GET' and request.accept_mimetypes.best == 'text/html':
+        flash('You are not a member of this group')
+        return redirect(url_for('main.dashboard'))
+    return jsonify({'success': False, 'message': 'You are not a member of this group'}), 403
+
+def group_conditional(view):
+    """Answer conditional GETs for a group's pages from its version alone.
+    
+    Goes under ``group_member_required``. The version is read with one
+    primary key lookup; when the client's ETag still matches, a 304 is
+    returned without running the view.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        
+        group_id = kwargs['group_id']
+        version = db.session.query(Group.version).filter(Group.id == group_id).scalar()
+        if version is None:
+            abort(404)
+        
+        # Pages are rendered per user, so the user is part of the tag. There is
+        # no Last-Modified: its whole seconds would miss a second write in the
+        # same second, and If-Modified-Since would then get a stale 304.
+        etag = f'g{group_id}-v{version}-u{current_user.id}'
+        
+        # A pending flash message would be lost on a 304
+        if '_flashes' not in session and request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        
+        if response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapped
+
+def idempotent(view):
+    """Replay the stored response when a POST repeats an ``Idempotency-Key``.
+    
+    Goes under ``login_required``. The view's write function records its
+    response with :func:`remember_response` in the same transaction as the
+    write, so a key is only ever stored alongside a committed result.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or request.method != 'POST':
+            return view(*args, **kwargs)
+        if len(key) > 64:
+            return jsonify({'success': False, 'message': 'Idempotency-Key must be at most 64 characters'}), 400
+        
+        g.idempotency = {'user_id': current_user.id, 'key': key, 'endpoint': request.endpoint,
+                         'fingerprint': hashlib.sha256(request.get_data()).hexdigest()}
+        try:
+            stored = stored_response(g.idempotency)
+            if stored is None:
+                return view(*args, **kwargs)
+        except IntegrityError:
+            # A concurrent request with the same key committed first
+            db.session.rollback()
+            stored = stored_response(g.idempotency)
+            if stored is None:
+                raise
+        return stored
+    return wrapped
+
+def stored_response(idempotency):
+    row = IdempotencyKey.query.filter_by(user_id=idempotency['user_id'], key=idempotency['key']).first()
+    if row is None:
+        return None
+    if (row.endpoint, row.fingerprint) != (idempotency['endpoint'], idempotency['fingerprint']):
+        return jsonify({'success': False, 'message': 'Idempotency-Key was already used for a different request'}), 422
+    response = current_app.response_class(row.response, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def remember_response(idempotency, body):
+    """Store ``body`` under the request's Idempotency-Key, if it sent one"""
+    if idempotency is not None:
+        db.session.add(IdempotencyKey(response=json.dumps(body), **idempotency))
+
+def commit_write(fn):
+    """Run the write function ``fn``, commit, and return its result.
+    
+    With WRITE_COALESCE_MS set, ``fn`` runs on the committer thread in one
+    transaction with other requests' writes, so it must not use
+    ``current_user``, ``url_for`` or objects from the request's session.
+    Either way this only returns once the write has committed.
+    """
+    coalescer = current_app.extensions.get('write_coalescer')
+    if coalescer is None:
+        result = fn()
+        db.session.commit()
+        return result
+    # Hand the connection back while waiting so the committer can have it
+    db.session.rollback()
+    return coalescer.submit(fn)
+
+def run_write_batch(flask_app, fns):
+    """Run coalesced write functions in one transaction, falling back to one each if it fails"""
+    with flask_app.app_context():
+        metrics.write_batch_size.observe(len(fns))
+        try:
+            results = [fn() for fn in fns]
+            db.session.commit()
+            return [(True, result) for result in results]
+        except Exception as e:
+            db.session.rollback()
+            if len(fns) == 1:
+                return [(False, e)]
+        
+        # One bad write (a repeated idempotency key, say) must not fail the rest
+        outcomes = []
+        for fn in fns:
+            try:
+                result = fn()
+                db.session.commit()
+                outcomes.append((True, result))
+            except Exception as e:
+                db.session.rollback()
+                outcomes.append((False, e))
+        return outcomes
+
+def write_queue_full():
+    return jsonify({'success': False, 'message': 'Too many changes are being saved. Try again shortly.'}), 429
+
+def group_member_required(view):
+    """Reject the request unless the current user belongs to ``group_id``.
+    
+    Goes under ``login_required``. Page loads are redirected to the
+    dashboard, everything else gets a JSON 403.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not is_group_member(kwargs['group_id']):
+            return membership_denied()
+        return view(*args, **kwargs)
+    return wrapped
 
 def generate_group_code():
     """Generate a unique 6-character group code"""
@@ -98,13 +487,95 @@ def generate_group_code():
         if not Group.query.filter_by(code=code).first():
             return code
 
-@app.route('/')
+def group_channel(group_id):
+    return f'group:{group_id}'
+
+def queue_group_event(group_id, event):
+    """Publish ``event`` to the group's live stream once the transaction commits"""
+    db.session.info.setdefault('group_events', []).append((group_id, event))
+
+@event.listens_for(Session, 'after_commit')
+def publish_group_events(session):
+    pending = session.info.pop('group_events', None)
+    if not pending or not has_app_context():
+        return
+    by_channel = {}
+    for group_id, group_event in pending:
+        by_channel.setdefault(group_channel(group_id), []).append(group_event)
+    try:
+        backend = current_app.extensions['event_backend']
+        for channel, events in by_channel.items():
+            backend.publish(channel, events)
+    except Exception:
+        current_app.logger.exception('Could not publish group events')
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_group_events(session, previous_transaction):
+    session.info.pop('group_events', None)
+
+@main.before_app_request
+def start_request_metrics():
+    metrics.start_request()
+
+@main.after_app_request
+def record_request_metrics(response):
+    request_data = metrics.request_metrics()
+    if request_data is None:
+        return response
+    
+    endpoint = request.endpoint or 'unmatched'
+    elapsed = time.perf_counter() - request_data['started']
+    metrics.request_duration.observe(elapsed, endpoint, request.method, response.status_code)
+    metrics.request_queries.observe(request_data['queries'], endpoint)
+    metrics.request_db_time.observe(request_data['db_time'], endpoint)
+    response.headers['Server-Timing'] = metrics.server_timing(request_data, elapsed)
+    
+    # The same statement issued over and over in one request is usually a lazy load in a loop
+    if request_data['statements']:
+        statement, count = max(request_data['statements'].items(), key=lambda item: item[1])
+        if count >= current_app.config['N_PLUS_ONE_THRESHOLD']:
+            metrics.repeated_queries.inc(endpoint)
+            current_app.logger.warning('Possible N+1 in %s: statement ran %d times: %s',
+                               endpoint, count, ' '.join(statement.split())[:300])
+    return response
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append((context, time.perf_counter()))
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(context):
+    """Drop the start time of a statement that failed, which never reaches after_cursor_execute"""
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started and started[-1][0] is context.execution_context:
+        started.pop()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()[1]
+    metrics.record_query(statement, elapsed)
+    
+    threshold = current_app.config.get('SLOW_QUERY_MS') if has_app_context() else None
+    if threshold is not None and elapsed * 1000 >= threshold:
+        endpoint = request.endpoint if has_request_context() else None
+        metrics.slow_queries.inc(endpoint or 'none')
+        current_app.logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint,
+                                   ' '.join(statement.split())[:500])
+
+@main.route('/metrics')
+def prometheus_metrics():
+    """Expose request, database and section timings in Prometheus text format"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/')
 def index():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     return render_template('index.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         try:
@@ -126,26 +597,31 @@ def register():
                 return jsonify({'success': False, 'message': 'Email already exists'})
             
             # Create new user
+            with timed('password_hash'):
+                password_hash = current_app.extensions['password_hasher'].hash(password)
             user = User(
                 email=email,
                 name=name,
-                password_hash=generate_password_hash(password)
+                password_hash=password_hash
             )
             
             db.session.add(user)
             db.session.commit()
             
             login_user(user)
-            return jsonify({'success': True, 'redirect': url_for('dashboard')})
+            return jsonify({'success': True, 'redirect': url_for('main.dashboard')})
             
+        except QueueFull:
+            metrics.password_hash_rejections.inc('register')
+            return jsonify({'success': False, 'message': 'Too many sign-ups right now. Try again shortly.'}), 429
         except Exception as e:
             db.session.rollback()
-            print(f"Registration error: {e}")  # For debugging
+            current_app.logger.exception('Registration error')
             return jsonify({'success': False, 'message': 'Registration failed. Please try again.'})
     
     return render_template('auth.html', mode='register')
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         try:
@@ -157,35 +633,58 @@ def login():
                 return jsonify({'success': False, 'message': 'Email and password are required'})
         
             user = User.query.filter_by(email=email).first()
+            hasher = current_app.extensions['password_hasher']
         
-            if user and check_password_hash(user.password_hash, password):
+            with timed('password_hash'):
+                valid = user is not None and hasher.verify(user.password_hash, password)
+            if valid:
+                if hasher.needs_rehash(user.password_hash):
+                    rehash_password(user, password)
                 login_user(user)
-                return jsonify({'success': True, 'redirect': url_for('dashboard')})
+                return jsonify({'success': True, 'redirect': url_for('main.dashboard')})
             else:
                 return jsonify({'success': False, 'message': 'Invalid email or password'})
             
+        except QueueFull:
+            metrics.password_hash_rejections.inc('login')
+            return jsonify({'success': False, 'message': 'Too many sign-in attempts right now. Try again shortly.'}), 429
         except Exception as e:
-            print(f"Login error: {e}")  # For debugging
+            current_app.logger.exception('Login error')
             return jsonify({'success': False, 'message': 'Login failed. Please try again.'})
     
     return render_template('auth.html', mode='login')
 
-@app.route('/logout')
+def rehash_password(user, password):
+    """Store a fresh hash made with the current parameters.
+
+    Best effort: if the hashing pool is busy the old hash stays and the
+    upgrade is retried on a later login.
+    """
+    try:
+        with timed('password_hash'):
+            user.password_hash = current_app.extensions['password_hasher'].hash(password)
+    except QueueFull:
+        metrics.password_hash_rejections.inc('rehash')
+        return
+    db.session.commit()
+    current_app.extensions['user_cache'].invalidate(user.id)
+
+@main.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/dashboard')
+@main.route('/dashboard')
 @login_required
 def dashboard():
-    user_groups = db.session.query(Group).join(GroupMember).filter(
-        GroupMember.user_id == current_user.id
-    ).all()
-    
-    return render_template('dashboard.html', groups=user_groups)
+    this_month = rollup_month(datetime.now())
+    spent = user_monthly_totals(current_user.id, this_month, this_month)
+    return render_template('dashboard.html', groups=get_group_summaries(current_user.id),
+                           spent_this_month=spent[0]['owed'] if spent else 0,
+                           positions=get_user_positions(current_user.id))
 
-@app.route('/create-group', methods=['GET', 'POST'])
+@main.route('/create-group', methods=['GET', 'POST'])
 @login_required
 def create_group():
     if request.method == 'POST':
@@ -206,16 +705,17 @@ def create_group():
         member = GroupMember(group_id=group.id, user_id=current_user.id)
         db.session.add(member)
         db.session.commit()
+        invalidate_membership(group.id, current_user.id)
         
         return jsonify({
             'success': True, 
             'group_code': group.code,
-            'redirect': url_for('group_detail', group_id=group.id)
+            'redirect': url_for('main.group_detail', group_id=group.id)
         })
     
     return render_template('create_group.html')
 
-@app.route('/join-group', methods=['GET', 'POST'])
+@main.route('/join-group', methods=['GET', 'POST'])
 @login_required
 def join_group():
     if request.method == 'POST':
@@ -227,73 +727,216 @@ def join_group():
             return jsonify({'success': False, 'message': 'Invalid group code'})
         
         # Check if user is already a member
-        existing_member = GroupMember.query.filter_by(
-            group_id=group.id, user_id=current_user.id
-        ).first()
-        
-        if existing_member:
+        if is_group_member(group.id):
             return jsonify({'success': False, 'message': 'You are already a member of this group'})
         
         member = GroupMember(group_id=group.id, user_id=current_user.id)
         db.session.add(member)
+        bump_group_version(group.id)
+        queue_group_event(group.id, {'type': 'members'})
         db.session.commit()
+        invalidate_membership(group.id, current_user.id)
         
         return jsonify({
             'success': True,
-            'redirect': url_for('group_detail', group_id=group.id)
+            'redirect': url_for('main.group_detail', group_id=group.id)
         })
     
     return render_template('join_group.html')
 
-@app.route('/group/<int:group_id>')
+@main.route('/group/<int:group_id>/leave', methods=['POST'])
 @login_required
-def group_detail(group_id):
-    group = Group.query.get_or_404(group_id)
+@group_member_required
+def leave_group(group_id):
+    """Leave a group; only allowed once the user's balance is settled"""
+    balance = MemberBalance.query.filter_by(group_id=group_id, user_id=current_user.id).first()
+    # Amounts are whole cents, so anything that does not round to 0 cents is real money
+    if balance is not None and round(balance.balance * 100) != 0:
+        return jsonify({'success': False, 'message': 'Settle your balance before leaving the group'}), 400
     
-    # Check if user is a member
-    member = GroupMember.query.filter_by(
-        group_id=group_id, user_id=current_user.id
-    ).first()
+    GroupMember.query.filter_by(group_id=group_id, user_id=current_user.id).delete()
+    if balance is not None:
+        db.session.delete(balance)
+    remove_member_pairs(group_id, current_user.id)
+    bump_group_version(group_id)
+    queue_group_event(group_id, {'type': 'members'})
+    db.session.commit()
+    invalidate_membership(group_id, current_user.id)
     
-    if not member:
-        flash('You are not a member of this group')
-        return redirect(url_for('dashboard'))
+    return jsonify({'success': True, 'redirect': url_for('main.dashboard')})
+
+@main.app_template_global()
+def cached_fragment(name, *key_parts, caller):
+    """Render a ``{% call %}`` block once per key and serve it from the fragment cache after that.
+    
+    Used as ``{% call cached_fragment('balances', group.id, group.version) %}``;
+    the key must cover everything the block depends on, and the block must
+    look the same to every viewer.
+    """
+    cache = current_app.extensions['fragment_cache']
+    key = ':'.join(str(part) for part in ('fragment', name) + key_parts)
+    html, tier = cache.lookup(key)
+    metrics.fragment_cache_lookups.inc(name, tier or 'miss')
+    if html is None:
+        html = str(caller())
+        cache.set(key, html)
+    return Markup(html)
+
+@main.route('/group/<int:group_id>')
+@login_required
+@group_member_required
+@group_conditional
+def group_detail(group_id):
+    group = Group.query.get_or_404(group_id)
     
-    expenses = Expense.query.filter_by(group_id=group_id).order_by(Expense.date.desc()).all()
     members = db.session.query(User).join(GroupMember).filter(
         GroupMember.group_id == group_id
     ).all()
+    member_names = {m.id: m.name for m in members}
     
-    # Calculate balances
-    balances = calculate_group_balances(group_id)
-    
+    # Expenses and balances are loaded by the template, only when their
+    # fragments are not already cached for this group version
     return render_template('group_detail.html', 
                          group=group, 
-                         expenses=expenses, 
+                         load_expense_page=functools.partial(get_expense_page, group_id),
+                         load_balances=functools.partial(calculate_group_balances, group_id),
                          members=members,
-                         balances=balances)
+                         member_names=member_names)
+
+@main.route('/group/<int:group_id>/expenses')
+@login_required
+@group_member_required
+@group_conditional
+def group_expenses(group_id):
+    """Return the next page of a group's expense feed as JSON"""
+    try:
+        cursor = decode_expense_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    expenses, next_cursor = get_expense_page(group_id, cursor, expense_page_limit())
+    return expense_page_response(group_id, expenses, next_cursor)
+
+@main.route('/group/<int:group_id>/expenses/search')
+@login_required
+@group_member_required
+@group_conditional
+def search_group_expenses(group_id):
+    """Search a group's expenses: ``?q=&payer=&member=&since=&until=&cursor=``"""
+    try:
+        cursor = decode_expense_cursor(request.args.get('cursor'))
+        since = parse_export_date(request.args.get('since'))
+        until = parse_export_date(request.args.get('until'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor or date'}), 400
+    
+    expenses, next_cursor = search_expenses(
+        group_id, request.args.get('q', ''),
+        payer=request.args.get('payer', type=int),
+        member=request.args.get('member', type=int),
+        since=since, until=until, cursor=cursor, limit=expense_page_limit()
+    )
+    return expense_page_response(group_id, expenses, next_cursor)
+
+def expense_page_limit():
+    """The ``limit`` query argument, EXPENSE_PAGE_SIZE by default and clamped to 1..100"""
+    return max(1, min(request.args.get('limit', current_app.config['EXPENSE_PAGE_SIZE'], type=int), 100))
+
+def group_member_names(group_id):
+    return dict(db.session.query(User.id, User.name).join(GroupMember).filter(
+        GroupMember.group_id == group_id
+    ).all())
+
+def expense_page_response(group_id, expenses, next_cursor):
+    member_names = group_member_names(group_id)
+    return jsonify({
+        'success': True,
+        'expenses': [serialize_expense(expense, member_names) for expense in expenses],
+        'next_cursor': next_cursor
+    })
+
+@main.route('/group/<int:group_id>/events')
+@login_required
+@group_member_required
+def group_events(group_id):
+    """Stream live balance and expense updates as Server-Sent Events.
+    
+    Answers 204, which tells EventSource to stop reconnecting, when streams
+    are disabled or this process already holds EVENT_MAX_STREAMS of them.
+    """
+    broker = current_app.extensions['event_broker']
+    if (not current_app.config['EVENT_STREAMS_ENABLED']
+            or broker.subscriber_count() >= current_app.config['EVENT_MAX_STREAMS']):
+        return Response(status=204)
+    current_app.extensions['event_backend'].start()
+    keepalive = current_app.config['EVENT_KEEPALIVE']
+    
+    # Runs after the request context is gone, so it must not touch the app
+    def stream():
+        subscription = broker.subscribe(group_channel(group_id))
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                group_event = subscription.get(timeout=keepalive)
+                yield ': keepalive\n\n' if group_event is None else format_sse(group_event)
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-@app.route('/add-expense/<int:group_id>', methods=['GET', 'POST'])
+@main.route('/add-expense/<int:group_id>', methods=['GET', 'POST'])
 @login_required
+@group_member_required
+@group_conditional
+@idempotent
 def add_expense(group_id):
     group = Group.query.get_or_404(group_id)
     
     if request.method == 'POST':
         data = request.get_json()
+        try:
+            split_members = list(dict.fromkeys(int(x) for x in data.get('split_members') or []))
+            amount = float(data.get('amount'))
+            paid_by = int(data.get('paid_by'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Invalid amount, payer or split'}), 400
+        description = data.get('description')
+        if amount <= 0:
+            return jsonify({'success': False, 'message': 'Amount must be positive'}), 400
+        # An empty split would credit the payer with nobody owing it
+        if not split_members:
+            return jsonify({'success': False, 'message': 'Split the expense with at least one member'}), 400
+        if not {paid_by, *split_members} <= group_member_ids(group_id):
+            return jsonify({'success': False, 'message': 'The payer and everyone in the split must be members'}), 400
+        body = {'success': True, 'redirect': url_for('main.group_detail', group_id=group_id)}
+        idempotency = g.get('idempotency')
         
-        expense = Expense(
-            group_id=group_id,
-            description=data.get('description'),
-            amount=float(data.get('amount')),
-            paid_by=int(data.get('paid_by')),
-            date=datetime.now(),
-            split_members=','.join(map(str, data.get('split_members', [])))
-        )
-        
-        db.session.add(expense)
-        db.session.commit()
+        def write():
+            expense = Expense(
+                group_id=group_id,
+                description=description,
+                amount=amount,
+                paid_by=paid_by,
+                date=datetime.now(),
+                split_members=','.join(map(str, split_members))
+            )
+            expense.shares = build_expense_shares(expense.amount, split_members)
+            
+            db.session.add(expense)
+            apply_expense_to_ledger(expense)
+            queue_group_event(group_id, {'type': 'expense',
+                                         'expense': serialize_expense(expense, group_member_names(group_id))})
+            result = dict(body, expense_id=expense.id)
+            remember_response(idempotency, result)
+            return result
         
-        return jsonify({'success': True, 'redirect': url_for('group_detail', group_id=group_id)})
+        try:
+            return jsonify(commit_write(write))
+        except QueueFull:
+            return write_queue_full()
     
     # Convert User objects to dictionaries for JSON serialization
     members_query = db.session.query(User).join(GroupMember).filter(
@@ -304,21 +947,48 @@ def add_expense(group_id):
     
     return render_template('add_expense.html', group=group, members=members)
 
-@app.route('/delete-expense/<int:expense_id>', methods=['POST'])
+@main.route('/group/<int:group_id>/expenses/bulk', methods=['POST'])
+@login_required
+@group_member_required
+def bulk_add_expenses(group_id):
+    """Import many expenses from a JSON array or CSV upload in one transaction"""
+    Group.query.get_or_404(group_id)
+    
+    try:
+        if 'file' in request.files:
+            records = read_expense_csv(io.TextIOWrapper(request.files['file'].stream, encoding='utf-8'))
+        elif request.mimetype == 'text/csv':
+            records = read_expense_csv(io.StringIO(request.get_data(as_text=True)))
+        else:
+            data = request.get_json()
+            records = data.get('expenses') if isinstance(data, dict) else data
+            if not isinstance(records, list):
+                raise ValueError('Expected a JSON array of expenses')
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'message': f'Could not read expenses: {e}'}), 400
+    
+    strict = request.args.get('strict', type=int) == 1
+    imported, errors = import_expenses(group_id, records, strict=strict)
+    
+    return jsonify({'success': not errors, 'imported': imported, 'errors': errors})
+
+@main.route('/delete-expense/<int:expense_id>', methods=['POST'])
 @login_required
 def delete_expense(expense_id):
     try:
         expense = Expense.query.get_or_404(expense_id)
         
         # Check if user is a member of the group
-        member = GroupMember.query.filter_by(
-            group_id=expense.group_id, user_id=current_user.id
-        ).first()
-        
-        if not member:
+        if not is_group_member(expense.group_id):
             return jsonify({'success': False, 'message': 'You are not authorized to delete this expense'})
         
+        checkpoint = latest_checkpoint(expense.group_id)
+        if checkpoint is not None and expense.id <= checkpoint.expense_id:
+            return jsonify({'success': False, 'message': 'This expense is part of closed history and cannot be deleted'})
+        
         group_id = expense.group_id
+        apply_expense_to_ledger(expense, sign=-1)
+        queue_group_event(group_id, {'type': 'expense_deleted', 'id': expense.id})
         db.session.delete(expense)
         db.session.commit()
         
@@ -326,15 +996,19 @@ def delete_expense(expense_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"Delete expense error: {e}")
+        current_app.logger.exception('Delete expense error')
         return jsonify({'success': False, 'message': 'Failed to delete expense'})
 
-@app.route('/settle-up/<int:group_id>')
+@main.route('/settle-up/<int:group_id>')
 @login_required
+@group_member_required
+@group_conditional
 def settle_up(group_id):
     group = Group.query.get_or_404(group_id)
-    balances = calculate_group_balances(group_id)
-    settlements = calculate_settlements(balances)
+    
+    def load_balances_and_settlements():
+        balances = calculate_group_balances(group_id)
+        return balances, calculate_settlements(balances)
     
     members = db.session.query(User).join(GroupMember).filter(
         GroupMember.group_id == group_id
@@ -342,266 +1016,1801 @@ def settle_up(group_id):
     
     return render_template('settle_up.html', 
                          group=group, 
-                         balances=balances,
-                         settlements=settlements,
+                         load_balances_and_settlements=load_balances_and_settlements,
                          members=members)
 
-@app.route('/mark-settled', methods=['POST'])
+@main.route('/mark-settled', methods=['POST'])
 @login_required
+@idempotent
 def mark_settled():
     data = request.get_json()
+    try:
+        group_id = int(data.get('group_id'))
+        from_user = int(data.get('from_user'))
+        to_user = int(data.get('to_user'))
+        amount = float(data.get('amount'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid settlement'}), 400
     
-    settlement = Settlement(
-        group_id=data.get('group_id'),
-        from_user=data.get('from_user'),
-        to_user=data.get('to_user'),
-        amount=float(data.get('amount')),
-        date=datetime.now()
-    )
+    if not is_group_member(group_id):
+        return membership_denied()
+    if amount <= 0:
+        return jsonify({'success': False, 'message': 'Amount must be positive'}), 400
+    if from_user == to_user or not {from_user, to_user} <= group_member_ids(group_id):
+        return jsonify({'success': False, 'message': 'A settlement is between two members of the group'}), 400
+    idempotency = g.get('idempotency')
     
-    db.session.add(settlement)
-    db.session.commit()
+    def write():
+        settlement = Settlement(
+            group_id=group_id,
+            from_user=from_user,
+            to_user=to_user,
+            amount=amount,
+            date=datetime.now()
+        )
+        
+        db.session.add(settlement)
+        apply_settlement_to_ledger(settlement)
+        queue_group_event(group_id, {'type': 'settlement', 'from_user': settlement.from_user,
+                                     'to_user': settlement.to_user, 'amount': settlement.amount})
+        remember_response(idempotency, {'success': True})
+        return {'success': True}
     
-    return jsonify({'success': True})
+    try:
+        return jsonify(commit_write(write))
+    except QueueFull:
+        return write_queue_full()
 
-@app.route('/download-pdf/<int:group_id>')
+@main.route('/download-pdf/<int:group_id>')
 @login_required
+@group_member_required
+@group_conditional
 def download_pdf(group_id):
     try:
         group = Group.query.get_or_404(group_id)
         
-        # Check if user is a member
-        member = GroupMember.query.filter_by(
-            group_id=group_id, user_id=current_user.id
-        ).first()
+        # Serve a cached copy of this version if there is one, otherwise render it now
+        path = current_app.extensions['report_cache'].get(report_cache_key(group.id, group.version))
+        if path is None:
+            path = render_group_report(group_id)
         
-        if not member:
-            return "Unauthorized", 403
+        return send_file(path, mimetype='application/pdf', as_attachment=True,
+                         download_name=f'{group.name}_expenses.pdf', etag=False)
         
-        # Get data
-        expenses = Expense.query.filter_by(group_id=group_id).order_by(Expense.date.desc()).all()
-        members = db.session.query(User).join(GroupMember).filter(
-            GroupMember.group_id == group_id
-        ).all()
-        balances = calculate_group_balances(group_id)
-        settlements = calculate_settlements(balances)
-        
-        # Create PDF
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Title
-        title_style = ParagraphStyle(
+    except Exception as e:
+        current_app.logger.exception('PDF generation error')
+        return "Error generating PDF", 500
+
+@main.route('/export/<int:group_id>/<kind>.<fmt>')
+@login_required
+@group_member_required
+@group_conditional
+def export_group(group_id, kind, fmt):
+    """Stream a group's expenses, settlements or shares as CSV or NDJSON"""
+    if kind not in EXPORT_QUERIES or fmt not in ('csv', 'ndjson'):
+        abort(404)
+    
+    try:
+        since = parse_export_date(request.args.get('since'))
+        until = parse_export_date(request.args.get('until'))
+    except ValueError:
+        return "Invalid date, use YYYY-MM-DD or an ISO timestamp", 400
+    
+    stmt = EXPORT_QUERIES[kind](group_id, since, until)
+    rows = db.session.execute(stmt.execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE']))
+    
+    if fmt == 'csv':
+        body, mimetype = iter_csv(rows), 'text/csv'
+    else:
+        body, mimetype = iter_ndjson(rows), 'application/x-ndjson'
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="group_{group_id}_{kind}.{fmt}"'
+    return response
+
+def parse_export_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+def filter_by_date(stmt, column, since, until):
+    """Limit an export to [since, until) so incremental pulls only read the new slice"""
+    if since:
+        stmt = stmt.where(column >= since)
+    if until:
+        stmt = stmt.where(column < until)
+    return stmt
+
+def history_query(group_id, build, *order_by):
+    """Order ``build(expense, share, settlement)`` over the live tables, plus the archive if the group has one"""
+    stmt = build(*HOT_HISTORY)
+    if not group_has_archive(group_id):
+        return stmt.order_by(*(stmt.selected_columns[name] for name in order_by))
+    rows = union_all(build(*ARCHIVED_HISTORY), stmt).subquery()
+    return select(rows).order_by(*(rows.c[name] for name in order_by))
+
+def export_expenses_query(group_id, since, until):
+    def build(expense, share, settlement):
+        stmt = select(
+            expense.id, expense.date, expense.description, expense.amount,
+            expense.paid_by, User.name.label('paid_by_name')
+        ).join(User, User.id == expense.paid_by).where(expense.group_id == group_id)
+        return filter_by_date(stmt, expense.date, since, until)
+    return history_query(group_id, build, 'date', 'id')
+
+def export_settlements_query(group_id, since, until):
+    def build(expense, share, settlement):
+        payer = aliased(User)
+        payee = aliased(User)
+        stmt = select(
+            settlement.id, settlement.date, settlement.from_user, payer.name.label('from_name'),
+            settlement.to_user, payee.name.label('to_name'), settlement.amount
+        ).join(payer, payer.id == settlement.from_user).join(
+            payee, payee.id == settlement.to_user
+        ).where(settlement.group_id == group_id)
+        return filter_by_date(stmt, settlement.date, since, until)
+    return history_query(group_id, build, 'date', 'id')
+
+def export_shares_query(group_id, since, until):
+    def build(expense, share, settlement):
+        stmt = select(
+            share.expense_id, expense.date, expense.description,
+            share.user_id, User.name.label('user_name'), share.share_amount
+        ).join(expense, expense.id == share.expense_id).join(
+            User, User.id == share.user_id
+        ).where(expense.group_id == group_id)
+        return filter_by_date(stmt, expense.date, since, until)
+    return history_query(group_id, build, 'date', 'expense_id')
+
+EXPORT_QUERIES = {
+    'expenses': export_expenses_query,
+    'settlements': export_settlements_query,
+    'shares': export_shares_query
+}
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def iter_csv(rows):
+    """Yield CSV text one line at a time, starting with the header"""
+    line = io.StringIO()
+    writer = csv.writer(line)
+    
+    writer.writerow(rows.keys())
+    for row in rows:
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+        writer.writerow([export_value(value) for value in row])
+    yield line.getvalue()
+
+def iter_ndjson(rows):
+    """Yield one JSON object per line"""
+    keys = list(rows.keys())
+    for row in rows:
+        yield json.dumps(dict(zip(keys, map(export_value, row))), separators=(',', ':')) + '\n'
+
+@main.route('/group/<int:group_id>/report', methods=['POST'])
+@login_required
+@group_member_required
+def request_report(group_id):
+    """Queue a PDF report for background rendering"""
+    group = Group.query.get_or_404(group_id)
+    
+    download_url = url_for('main.download_pdf', group_id=group_id)
+    if current_app.extensions['report_cache'].get(report_cache_key(group.id, group.version)):
+        return jsonify({'success': True, 'status': Job.DONE, 'download_url': download_url})
+    
+    try:
+        job = current_app.extensions['report_queue'].submit(('report', group_id), run_report_job, current_app._get_current_object(), group_id,
+                                  owner=current_user.id)
+    except QueueFull:
+        return jsonify({'success': False, 'message': 'Too many reports are being generated. Try again shortly.'}), 429
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('main.report_status', job_id=job.id)
+    }), 202
+
+@main.route('/report-jobs/<job_id>')
+@login_required
+def report_status(job_id):
+    """Report the status of a queued PDF job to any member of its group.
+    
+    Requests for a report already being rendered share one job, so the
+    job's owner is only whoever asked first.
+    """
+    job = current_app.extensions['report_queue'].get(job_id)
+    if job is None or not is_group_member(job.key[1]):
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    
+    result = job.to_dict()
+    result['success'] = True
+    if job.status == Job.DONE:
+        result['download_url'] = url_for('main.download_pdf', group_id=job.key[1])
+    return jsonify(result)
+
+@api.route('/groups')
+@login_required
+def api_groups():
+    """Batch read of several groups: ``?ids=1,2,3&fields=id,balances``.
+    
+    Without ``ids`` every group of the current user is returned. Each
+    requested field is loaded with one query across all the groups, and
+    the response carries an ETag built from the groups' versions.
+    """
+    try:
+        fields = parse_api_list(request.args.get('fields'), str) or list(API_DEFAULT_FIELDS)
+        group_ids = parse_api_list(request.args.get('ids'), int)
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma separated list of integers'}), 400
+    
+    unknown = sorted(set(fields) - set(API_GROUP_FIELDS))
+    if unknown:
+        return jsonify({'error': f'Unknown fields: {", ".join(unknown)}', 'fields': API_GROUP_FIELDS}), 400
+    if group_ids is not None and len(group_ids) > current_app.config['API_MAX_BATCH']:
+        return jsonify({'error': f'At most {current_app.config["API_MAX_BATCH"]} groups per request'}), 400
+    
+    query = db.session.query(Group).join(
+        GroupMember, and_(GroupMember.group_id == Group.id, GroupMember.user_id == current_user.id)
+    )
+    if group_ids is not None:
+        query = query.filter(Group.id.in_(group_ids))
+    groups = query.order_by(Group.id).all()
+    
+    forbidden = sorted(set(group_ids or ()) - {group.id for group in groups})
+    if forbidden:
+        return jsonify({'error': 'Not a member of some groups', 'group_ids': forbidden}), 403
+    
+    etag = versions_etag(current_user.id, [(group.id, group.version) for group in groups], *fields)
+    return conditional_json(etag, lambda: {'groups': serialize_api_groups(groups, fields)})
+
+@api.route('/groups/<int:group_id>/analytics')
+@login_required
+@group_member_required
+@group_conditional
+def api_group_analytics(group_id):
+    """Monthly group totals and per-member totals: ``?since=2024-01&until=2024-12``"""
+    try:
+        since, until = parse_month(request.args.get('since')), parse_month(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'since and until must look like YYYY-MM'}), 400
+    
+    return jsonify({
+        'group_id': group_id,
+        'months': group_monthly_totals(group_id, since, until),
+        'members': group_member_totals(group_id, since, until)
+    })
+
+@api.route('/analytics')
+@login_required
+def api_user_analytics():
+    """The current user's monthly totals across all their groups"""
+    try:
+        since, until = parse_month(request.args.get('since')), parse_month(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'since and until must look like YYYY-MM'}), 400
+    
+    current = rollup_month(datetime.now())
+    
+    def build():
+        months = user_monthly_totals(current_user.id, since, until)
+        this_month = next((month for month in months if month['month'] == current), None)
+        if this_month is None:
+            this_month = (user_monthly_totals(current_user.id, current, current) or
+                          [dict({field: 0 for field in ROLLUP_FIELDS}, month=current)])[0]
+        return {'months': months, 'this_month': this_month}
+    
+    etag = versions_etag(current_user.id, user_group_versions(current_user.id), 'analytics', current)
+    return conditional_json(etag, build)
+
+@api.route('/positions')
+@login_required
+def api_user_positions():
+    """What the current user owes and is owed overall, and by each person, across all their groups"""
+    etag = versions_etag(current_user.id, user_group_versions(current_user.id), 'positions')
+    return conditional_json(etag, lambda: get_user_positions(current_user.id))
+
+def user_group_versions(user_id):
+    """``(group_id, version)`` of every group the user belongs to, by group id"""
+    return db.session.query(Group.id, Group.version).join(
+        GroupMember, and_(GroupMember.group_id == Group.id, GroupMember.user_id == user_id)
+    ).order_by(Group.id).all()
+
+def versions_etag(user_id, versions, *parts):
+    """A short ETag for a response built for ``user_id`` from groups at these ``(group_id, version)``"""
+    etag = 'u{}-{}-{}'.format(user_id, ','.join(parts),
+                              ','.join(f'{group_id}.{version}' for group_id, version in versions))
+    return hashlib.sha1(etag.encode()).hexdigest()[:20]
+
+def conditional_json(etag, build):
+    """A 304 when the client already has ``etag``, otherwise ``build()`` as JSON"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def parse_api_list(value, cast):
+    """Split a comma separated query argument, or return None if it is absent"""
+    if value is None:
+        return None
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+def serialize_api_groups(groups, fields):
+    group_ids = [group.id for group in groups]
+    balances = {}
+    if 'balances' in fields or 'settlements' in fields:
+        balances = calculate_balances_for_groups(group_ids)
+    members = {}
+    if 'members' in fields:
+        for group_id, user_id, name in db.session.query(GroupMember.group_id, User.id, User.name).join(
+                User, User.id == GroupMember.user_id).filter(GroupMember.group_id.in_(group_ids)):
+            members.setdefault(group_id, {})[user_id] = name
+    
+    result = []
+    for group in groups:
+        item = {}
+        for field in fields:
+            if field == 'members':
+                item['members'] = members.get(group.id, {})
+            elif field == 'balances':
+                item['balances'] = {user_id: round(balance, 2)
+                                    for user_id, balance in balances.get(group.id, {}).items()}
+            elif field == 'settlements':
+                item['settlements'] = calculate_settlements(balances.get(group.id, {}))
+            elif field == 'total_spent':
+                item['total_spent'] = round(group.total_spent, 2)
+            else:
+                item[field] = getattr(group, field)
+        result.append(item)
+    return result
+
+def report_cache_key(group_id, version):
+    return f'group-{group_id}-v{version}.pdf'
+
+def run_report_job(flask_app, group_id):
+    """Render a report from a worker thread"""
+    with flask_app.app_context():
+        try:
+            return render_group_report(group_id)
+        finally:
+            db.session.remove()
+
+def render_group_report(group_id):
+    """Render the report for the group's current version into the cache"""
+    version = db.session.query(Group.version).filter(Group.id == group_id).scalar()
+    temp_path = current_app.extensions['report_cache'].temp_path()
+    try:
+        with open(temp_path, 'wb') as output:
+            build_group_report(group_id, output)
+        return current_app.extensions['report_cache'].put(report_cache_key(group_id, version), temp_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+class StreamingStory(list):
+    """Flowable list that pulls from a generator as ReportLab consumes it.
+    
+    ``doc.build`` checks ``len()`` before handling each flowable, so topping
+    the buffer up there keeps only a few flowables alive at any time.
+    """
+    
+    def __init__(self, flowables, lookahead=4):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+    
+    def __len__(self):
+        while self._source is not None and super().__len__() < self._lookahead:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return super().__len__()
+
+@functools.lru_cache(maxsize=None)
+def get_report_styles():
+    """Build the paragraph and table styles used by reports once per process"""
+    styles = getSampleStyleSheet()
+    
+    def table_style(header_color, header_size=12, body_size=None):
+        commands = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(header_color)),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), header_size),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]
+        if body_size:
+            commands.insert(5, ('FONTSIZE', (0, 1), (-1, -1), body_size))
+        return TableStyle(commands)
+    
+    return {
+        'title': ParagraphStyle(
             'CustomTitle',
             parent=styles['Heading1'],
             fontSize=24,
             spaceAfter=30,
             alignment=TA_CENTER,
             textColor=colors.HexColor('#2563eb')
-        )
-        story.append(Paragraph(f"Splitly Pro - {group.name}", title_style))
-        story.append(Spacer(1, 20))
-        
-        # Group Info
-        info_style = ParagraphStyle(
+        ),
+        'info': ParagraphStyle(
             'Info',
             parent=styles['Normal'],
             fontSize=12,
             spaceAfter=10
-        )
-        story.append(Paragraph(f"<b>Group Code:</b> {group.code}", info_style))
-        if group.description:
-            story.append(Paragraph(f"<b>Description:</b> {group.description}", info_style))
-        story.append(Paragraph(f"<b>Generated on:</b> {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", info_style))
-        story.append(Spacer(1, 20))
-        
-        # Summary
-        total_expenses = sum(expense.amount for expense in expenses)
-        story.append(Paragraph("<b>Summary</b>", styles['Heading2']))
-        story.append(Paragraph(f"Total Expenses: {total_expenses:.2f}", info_style))
-        story.append(Paragraph(f"Number of Expenses: {len(expenses)}", info_style))
-        story.append(Paragraph(f"Group Members: {len(members)}", info_style))
-        story.append(Spacer(1, 20))
-        
-        # Current Balances
-        story.append(Paragraph("<b>Current Balances</b>", styles['Heading2']))
-        balance_data = [['Member', 'Balance', 'Status']]
+        ),
+        'heading': styles['Heading2'],
+        'balance_table': table_style('#3b82f6'),
+        'settlement_table': table_style('#10b981'),
+        'analytics_table': table_style('#f59e0b', header_size=10, body_size=9),
+        'expense_table': table_style('#6366f1', header_size=10, body_size=9)
+    }
+
+def iter_report_expenses(group_id, member_names, chunk_size):
+    """Yield expense table rows newest first, merging in archived expenses if there are any"""
+    rows = iter_expense_history(HOT_HISTORY, group_id, member_names, chunk_size)
+    if group_has_archive(group_id):
+        archived = iter_expense_history(ARCHIVED_HISTORY, group_id, member_names, chunk_size)
+        rows = heapq.merge(rows, archived, key=lambda row: (row[0], row[1]), reverse=True)
+    
+    for date, expense_id, description, amount, payer_name, names in rows:
+        yield [
+            date.strftime('%m/%d/%Y'),
+            description[:30] + ('...' if len(description) > 30 else ''),
+            payer_name,
+            f" {amount:.2f}",
+            names[:40] + ('...' if len(names) > 40 else '')
+        ]
+
+def iter_expense_history(models, group_id, member_names, chunk_size):
+    """Yield ``(date, id, description, amount, payer, split names)`` newest first, in keyset chunks"""
+    expense, share, _ = models
+    cursor = None
+    while True:
+        query = db.session.query(
+            expense.id, expense.date, expense.description, expense.amount, User.name
+        ).join(User, User.id == expense.paid_by).filter(expense.group_id == group_id)
+        if cursor:
+            query = query.filter(expenses_before(cursor, expense))
+        rows = query.order_by(expense.date.desc(), expense.id.desc()).limit(chunk_size).all()
+        if not rows:
+            return
+        
+        split_names = {}
+        for expense_id, user_id in db.session.query(share.expense_id, share.user_id).filter(
+            share.expense_id.in_([row.id for row in rows])
+        ).order_by(share.id):
+            if user_id in member_names:
+                split_names.setdefault(expense_id, []).append(member_names[user_id])
+        
+        for expense_id, date, description, amount, payer_name in rows:
+            yield date, expense_id, description, amount, payer_name, ', '.join(split_names.get(expense_id, []))
+        
+        cursor = (rows[-1].date, rows[-1].id)
+
+@timed('pdf')
+def build_group_report(group_id, output):
+    """Write the PDF report for a group to a binary file object.
+    
+    Expenses are read from the database in chunks and laid out as a series of
+    page-sized tables, so memory stays flat however long the history is.
+    """
+    group = Group.query.get_or_404(group_id)
+    members = db.session.query(User).join(GroupMember).filter(
+        GroupMember.group_id == group_id
+    ).all()
+    balances = calculate_group_balances(group_id)
+    settlements = calculate_settlements(balances)
+    
+    doc = SimpleDocTemplate(output, pagesize=A4)
+    doc.build(StreamingStory(iter_report_flowables(group, members, balances, settlements)))
+
+def iter_report_flowables(group, members, balances, settlements):
+    """Yield the report's flowables in document order"""
+    styles = get_report_styles()
+    info_style = styles['info']
+    member_names = {m.id: m.name for m in members}
+    
+    # Title
+    yield Paragraph(f"Splitly Pro - {group.name}", styles['title'])
+    yield Spacer(1, 20)
+    
+    # Group Info
+    yield Paragraph(f"<b>Group Code:</b> {group.code}", info_style)
+    if group.description:
+        yield Paragraph(f"<b>Description:</b> {group.description}", info_style)
+    yield Paragraph(f"<b>Generated on:</b> {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", info_style)
+    yield Spacer(1, 20)
+    
+    # Summary
+    yield Paragraph("<b>Summary</b>", styles['heading'])
+    yield Paragraph(f"Total Expenses: {group.total_spent:.2f}", info_style)
+    yield Paragraph(f"Number of Expenses: {group.expense_count}", info_style)
+    yield Paragraph(f"Group Members: {len(members)}", info_style)
+    yield Spacer(1, 20)
+    
+    # Current Balances
+    yield Paragraph("<b>Current Balances</b>", styles['heading'])
+    balance_data = [['Member', 'Balance', 'Status']]
+    
+    for member in members:
+        balance = balances.get(member.id, 0)
+        if balance > 0.01:
+            status = "Gets back"
+            balance_str = f"+ {balance:.2f}"
+        elif balance < -0.01:
+            status = "Owes"
+            balance_str = f"- {abs(balance):.2f}"
+        else:
+            status = "Settled"
+            balance_str = " 0.00"
         
+        balance_data.append([member.name, balance_str, status])
+    
+    balance_table = Table(balance_data, colWidths=[2*inch, 1.5*inch, 1.5*inch], repeatRows=1)
+    balance_table.setStyle(styles['balance_table'])
+    yield balance_table
+    yield Spacer(1, 20)
+    
+    # Suggested Settlements
+    if settlements:
+        yield Paragraph("<b>Suggested Settlements</b>", styles['heading'])
+        settlement_data = [['From', 'To', 'Amount']]
+        
+        for settlement in settlements:
+            settlement_data.append([
+                member_names.get(settlement['from_user'], 'Unknown'),
+                member_names.get(settlement['to_user'], 'Unknown'),
+                f" {settlement['amount']:.2f}"
+            ])
+        
+        settlement_table = Table(settlement_data, colWidths=[2*inch, 2*inch, 1.5*inch], repeatRows=1)
+        settlement_table.setStyle(styles['settlement_table'])
+        yield settlement_table
+        yield Spacer(1, 20)
+    
+    # Analytics, from the monthly rollups
+    monthly = group_monthly_totals(group.id)
+    if monthly:
+        yield Paragraph("<b>Monthly Spending</b>", styles['heading'])
+        monthly_data = [['Month', 'Spent', 'Expenses', 'Settled']]
+        for month in monthly:
+            monthly_data.append([
+                datetime.strptime(month['month'], '%Y-%m').strftime('%b %Y'),
+                f" {month['paid']:.2f}",
+                month['expense_count'],
+                f" {month['settled_out']:.2f}"
+            ])
+        monthly_table = Table(monthly_data, colWidths=[1.5*inch, 1.5*inch, 1*inch, 1.5*inch], repeatRows=1)
+        monthly_table.setStyle(styles['analytics_table'])
+        yield monthly_table
+        yield Spacer(1, 20)
+        
+        yield Paragraph("<b>Spending by Member</b>", styles['heading'])
+        member_totals = group_member_totals(group.id)
+        member_data = [['Member', 'Paid', 'Share', 'Settled Out', 'Settled In']]
         for member in members:
-            balance = balances.get(member.id, 0)
-            if balance > 0.01:
-                status = "Gets back"
-                balance_str = f"+ {balance:.2f}"
-            elif balance < -0.01:
-                status = "Owes"
-                balance_str = f"- {abs(balance):.2f}"
-            else:
-                status = "Settled"
-                balance_str = " 0.00"
-            
-            balance_data.append([member.name, balance_str, status])
+            totals = member_totals.get(member.id)
+            if totals is None:
+                continue
+            member_data.append([
+                member.name,
+                f" {totals['paid']:.2f}",
+                f" {totals['owed']:.2f}",
+                f" {totals['settled_out']:.2f}",
+                f" {totals['settled_in']:.2f}"
+            ])
+        member_table = Table(member_data, colWidths=[2*inch, 1.1*inch, 1.1*inch, 1.1*inch, 1.1*inch], repeatRows=1)
+        member_table.setStyle(styles['analytics_table'])
+        yield member_table
+        yield Spacer(1, 20)
+    
+    # Expense Details, one page-sized table at a time
+    if group.expense_count:
+        yield Paragraph("<b>Expense Details</b>", styles['heading'])
+        header = ['Date', 'Description', 'Paid By', 'Amount', 'Split Between']
+        rows_per_table = current_app.config['REPORT_ROWS_PER_TABLE']
         
-        balance_table = Table(balance_data, colWidths=[2*inch, 1.5*inch, 1.5*inch])
-        balance_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3b82f6')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(balance_table)
-        story.append(Spacer(1, 20))
-        
-        # Suggested Settlements
-        if settlements:
-            story.append(Paragraph("<b>Suggested Settlements</b>", styles['Heading2']))
-            settlement_data = [['From', 'To', 'Amount']]
-            
-            for settlement in settlements:
-                from_user = next((m for m in members if m.id == settlement['from_user']), None)
-                to_user = next((m for m in members if m.id == settlement['to_user']), None)
-                
-                settlement_data.append([
-                    from_user.name if from_user else 'Unknown',
-                    to_user.name if to_user else 'Unknown',
-                    f" {settlement['amount']:.2f}"
-                ])
-            
-            settlement_table = Table(settlement_data, colWidths=[2*inch, 2*inch, 1.5*inch])
-            settlement_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#10b981')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(settlement_table)
-            story.append(Spacer(1, 20))
-        
-        # Expense Details
-        if expenses:
-            story.append(Paragraph("<b>Expense Details</b>", styles['Heading2']))
-            expense_data = [['Date', 'Description', 'Paid By', 'Amount', 'Split Between']]
-            
-            for expense in expenses:
-                split_member_ids = [int(x) for x in expense.split_members.split(',') if x]
-                split_names = [m.name for m in members if m.id in split_member_ids]
-                
-                expense_data.append([
-                    expense.date.strftime('%m/%d/%Y'),
-                    expense.description[:30] + ('...' if len(expense.description) > 30 else ''),
-                    expense.payer.name,
-                    f" {expense.amount:.2f}",
-                    ', '.join(split_names)[:40] + ('...' if len(', '.join(split_names)) > 40 else '')
-                ])
+        rows = iter_report_expenses(group.id, member_names, current_app.config['REPORT_CHUNK_SIZE'])
+        while True:
+            batch = list(itertools.islice(rows, rows_per_table))
+            if not batch:
+                break
+            expense_table = Table([header] + batch, colWidths=[1*inch, 2*inch, 1.5*inch, 1*inch, 2*inch],
+                                  repeatRows=1)
+            expense_table.setStyle(styles['expense_table'])
+            yield expense_table
+
+def read_expense_csv(stream):
+    """Read expense records from CSV with description, amount, paid_by, split_members and optional date columns"""
+    return list(csv.DictReader(stream))
+
+def group_member_ids(group_id):
+    return {user_id for (user_id,) in db.session.query(GroupMember.user_id).filter(
+        GroupMember.group_id == group_id
+    )}
+
+def parse_import_record(record, member_ids):
+    """Validate one import record and return a row for the expense table plus its split"""
+    if not isinstance(record, dict):
+        raise ValueError('Expected an object')
+    
+    description = (record.get('description') or '').strip()
+    if not description:
+        raise ValueError('Description is required')
+    if len(description) > 200:
+        raise ValueError('Description is longer than 200 characters')
+    
+    try:
+        amount = round(float(record.get('amount')), 2)
+    except (TypeError, ValueError):
+        raise ValueError('Amount must be a number')
+    if amount <= 0:
+        raise ValueError('Amount must be positive')
+    
+    try:
+        paid_by = int(record.get('paid_by'))
+    except (TypeError, ValueError):
+        raise ValueError('paid_by must be a user id')
+    if paid_by not in member_ids:
+        raise ValueError(f'Payer {paid_by} is not a member of this group')
+    
+    split = record.get('split_members')
+    if isinstance(split, str):
+        split = split.replace(';', ',').replace('|', ',').split(',')
+    try:
+        split = list(dict.fromkeys(int(x) for x in split or [] if str(x).strip()))
+    except (TypeError, ValueError):
+        raise ValueError('split_members must be user ids')
+    if not split:
+        raise ValueError('split_members is required')
+    outsiders = [user_id for user_id in split if user_id not in member_ids]
+    if outsiders:
+        raise ValueError(f'Users {outsiders} are not members of this group')
+    
+    date = record.get('date')
+    try:
+        date = datetime.fromisoformat(date) if date else datetime.now()
+    except (TypeError, ValueError):
+        raise ValueError('Date must be an ISO date or timestamp')
+    
+    row = {
+        'description': description,
+        'amount': amount,
+        'paid_by': paid_by,
+        'split_members': ','.join(map(str, split)),
+        'date': date
+    }
+    return row, split
+
+def import_expenses(group_id, records, batch_size=None, strict=False):
+    """Validate and insert expenses in batched statements inside one transaction.
+    
+    Returns ``(imported_count, errors)`` where errors lists ``{'row', 'message'}``
+    for every rejected record. With ``strict`` nothing is written if any
+    record is rejected.
+    """
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    member_ids = group_member_ids(group_id)
+    
+    valid, errors = [], []
+    for index, record in enumerate(records, start=1):
+        try:
+            valid.append(parse_import_record(record, member_ids))
+        except ValueError as e:
+            errors.append({'row': index, 'message': str(e)})
+    
+    if not valid or (strict and errors):
+        return 0, errors
+    
+    expense_table = Expense.__table__
+    share_table = ExpenseShare.__table__
+    deltas = {}
+    rollups = {}
+    pairs = {}
+    total = 0
+    
+    try:
+        # Writing the group row first holds its lock (SQLite's write lock) until commit, so
+        # no one else adds expenses to the group meanwhile and the new ids can be read back
+        # in order. An ordered RETURNING would make SQLite insert one row per statement.
+        bump_group_version(group_id)
+        last_id = db.session.query(func.max(Expense.id)).scalar() or 0
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            db.session.execute(expense_table.insert(), [dict(row, group_id=group_id) for row, _ in batch])
+            ids = db.session.execute(
+                select(expense_table.c.id)
+                .where(expense_table.c.group_id == group_id, expense_table.c.id > last_id)
+                .order_by(expense_table.c.id)
+            ).scalars().all()
+            if len(ids) != len(batch):
+                raise RuntimeError(f'Expected {len(batch)} new expense ids, found {len(ids)}')
+            last_id = ids[-1]
             
-            expense_table = Table(expense_data, colWidths=[1*inch, 2*inch, 1.5*inch, 1*inch, 2*inch])
-            expense_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#6366f1')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('FONTSIZE', (0, 1), (-1, -1), 9),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(expense_table)
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        # Create response
-        response = make_response(buffer.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename="{group.name}_expenses.pdf"'
+            shares = []
+            for expense_id, (row, split) in zip(ids, batch):
+                deltas[row['paid_by']] = deltas.get(row['paid_by'], 0) + row['amount']
+                split_shares = list(zip(split, split_amount(row['amount'], len(split))))
+                for user_id, share in split_shares:
+                    shares.append({'expense_id': expense_id, 'user_id': user_id, 'share_amount': share})
+                    deltas[user_id] = deltas.get(user_id, 0) - share
+                expense_rollup_deltas(row['date'], row['paid_by'], row['amount'], split_shares, into=rollups)
+                expense_pair_deltas(row['paid_by'], split_shares, into=pairs)
+                total += row['amount']
+            db.session.execute(share_table.insert(), shares)
         
-        return response
-        
-    except Exception as e:
-        print(f"PDF generation error: {e}")
-        return "Error generating PDF", 500
+        apply_balance_deltas(group_id, deltas)
+        apply_rollup_deltas(group_id, rollups)
+        apply_pair_deltas(group_id, pairs)
+        apply_group_totals(group_id, len(valid), total)
+        queue_group_event(group_id, {'type': 'expenses_imported', 'count': len(valid)})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    return len(valid), errors
+
+def encode_expense_cursor(expense):
+    """Encode an expense's (date, id) sort key as an opaque cursor"""
+    raw = f'{expense.date.isoformat()}|{expense.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
+def decode_expense_cursor(cursor):
+    """Decode a cursor into a (date, id) tuple, raising ValueError if malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date, expense_id = raw.split('|')
+        return datetime.fromisoformat(date), int(expense_id)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+def expenses_before(cursor, model=Expense):
+    """Filter for expenses that sort after ``cursor`` in newest-first order"""
+    date, expense_id = cursor
+    return or_(
+        model.date < date,
+        and_(model.date == date, model.id < expense_id)
+    )
+
+def get_expense_page(group_id, cursor=None, limit=None):
+    """Return one page of expenses, newest first, plus the cursor for the next page"""
+    limit = limit or current_app.config['EXPENSE_PAGE_SIZE']
+    query = Expense.query.filter(Expense.group_id == group_id).options(
+        joinedload(Expense.payer),
+        selectinload(Expense.shares)
+    )
+    
+    if cursor:
+        query = query.filter(expenses_before(cursor))
+    
+    expenses = query.order_by(Expense.date.desc(), Expense.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_expense_cursor(expenses[limit - 1]) if len(expenses) > limit else None
+    
+    return expenses[:limit], next_cursor
+
+EXPENSE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE expense_fts USING fts5(description, content='expense', content_rowid='id')",
+    "CREATE TRIGGER expense_fts_insert AFTER INSERT ON expense BEGIN "
+    "INSERT INTO expense_fts(rowid, description) VALUES (new.id, new.description); END",
+    "CREATE TRIGGER expense_fts_delete AFTER DELETE ON expense BEGIN "
+    "INSERT INTO expense_fts(expense_fts, rowid, description) VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER expense_fts_update AFTER UPDATE OF description ON expense BEGIN "
+    "INSERT INTO expense_fts(expense_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+    "INSERT INTO expense_fts(rowid, description) VALUES (new.id, new.description); END",
+    "INSERT INTO expense_fts(expense_fts) VALUES ('rebuild')",
+)
+
+# Up to this many text matches are fetched by id rather than by scanning the group
+SEARCH_ID_LIST_LIMIT = 1000
+
+def create_search_index():
+    """Create the FTS5 index over expense descriptions and return whether it exists.
+    
+    SQLite only. Triggers keep it in sync with every insert, update and
+    delete on ``expense``, whichever code path makes them.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    if inspect(db.engine).has_table('expense_fts'):
+        return True
+    try:
+        with db.engine.begin() as conn:
+            for ddl in EXPENSE_FTS_DDL:
+                conn.execute(text(ddl))
+    except OperationalError:
+        current_app.logger.warning('SQLite was built without FTS5, expense search falls back to LIKE')
+        return False
+    current_app.extensions.pop('expense_fts', None)
+    return True
+
+def search_uses_fts():
+    """Whether the FTS5 index is available, checked once per app"""
+    if 'expense_fts' not in current_app.extensions:
+        current_app.extensions['expense_fts'] = (db.engine.dialect.name == 'sqlite' and
+                                                 inspect(db.engine).has_table('expense_fts'))
+    return current_app.extensions['expense_fts']
+
+def expense_like_filter(terms):
+    """Filter matching every term as a substring, for databases without the FTS index"""
+    escaped = (term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for term in terms)
+    return and_(*(Expense.description.ilike(f'%{term}%', escape='\\') for term in escaped))
+
+@timed('search')
+def search_expenses(group_id, q, payer=None, member=None, since=None, until=None, cursor=None, limit=None):
+    """Return one page of a group's expenses matching the filters, newest first"""
+    limit = limit or current_app.config['EXPENSE_PAGE_SIZE']
+    query = Expense.query.options(
+        joinedload(Expense.payer),
+        selectinload(Expense.shares)
+    )
+    
+    terms = re.findall(r'\w+', q or '')
+    group_filter = Expense.group_id == group_id
+    if terms and search_uses_fts():
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        matches = 'SELECT rowid FROM expense_fts WHERE expense_fts MATCH :match'
+        ids = db.session.execute(text(f'{matches} LIMIT :limit'),
+                                 {'match': match, 'limit': SEARCH_ID_LIST_LIMIT + 1}).scalars().all()
+        if len(ids) <= SEARCH_ID_LIST_LIMIT:
+            # A rare term: fetch its few rows by id. Left to itself SQLite walks the
+            # group's date index and probes every row, so keep it off that index.
+            query = query.filter(Expense.id.in_(ids))
+            group_filter = Expense.group_id + 0 == group_id
+        else:
+            query = query.filter(Expense.id.in_(text(matches).bindparams(match=match)))
+    elif terms:
+        query = query.filter(expense_like_filter(terms))
+    if payer:
+        query = query.filter(Expense.paid_by == payer)
+    if member:
+        query = query.filter(Expense.shares.any(ExpenseShare.user_id == member))
+    query = filter_by_date(query, Expense.date, since, until)
+    if cursor:
+        query = query.filter(expenses_before(cursor))
+    
+    expenses = query.filter(group_filter).order_by(Expense.date.desc(), Expense.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_expense_cursor(expenses[limit - 1]) if len(expenses) > limit else None
+    
+    return expenses[:limit], next_cursor
+
+def serialize_expense(expense, member_names):
+    """Serialize an expense for the JSON feed"""
+    return {
+        'id': expense.id,
+        'description': expense.description,
+        'amount': expense.amount,
+        'paid_by': expense.paid_by,
+        'payer_name': expense.payer.name,
+        'date': expense.date.isoformat(),
+        'split_between': [
+            {'user_id': share.user_id,
+             'name': member_names.get(share.user_id, 'Unknown'),
+             'share_amount': share.share_amount}
+            for share in expense.shares
+        ]
+    }
+
+def get_group_summaries(user_id):
+    """Summarize every group a user belongs to in a single query"""
+    counted = aliased(GroupMember)
+    member_count = db.session.query(func.count(counted.id)).filter(
+        counted.group_id == Group.id
+    ).correlate(Group).scalar_subquery()
+    
+    rows = db.session.query(Group, member_count, MemberBalance.balance).join(
+        GroupMember, and_(GroupMember.group_id == Group.id, GroupMember.user_id == user_id)
+    ).outerjoin(
+        MemberBalance, and_(MemberBalance.group_id == Group.id, MemberBalance.user_id == user_id)
+    ).order_by(Group.created_at.desc()).all()
+    
+    return [{
+        'group': group,
+        'member_count': members,
+        'expense_count': group.expense_count,
+        'total_spent': group.total_spent,
+        'balance': balance or 0
+    } for group, members, balance in rows]
+
+@timed('balances')
 def calculate_group_balances(group_id):
     """Calculate how much each member owes or is owed"""
-    expenses = Expense.query.filter_by(group_id=group_id).all()
-    settlements = Settlement.query.filter_by(group_id=group_id).all()
+    rows = db.session.query(MemberBalance.user_id, MemberBalance.balance).filter(
+        MemberBalance.group_id == group_id
+    ).all()
     
-    balances = {}
+    return {user_id: balance for user_id, balance in rows}
+
+@timed('balances')
+def calculate_balances_for_groups(group_ids):
+    """Ledger balances of several groups in one query, as ``{group_id: {user_id: balance}}``"""
+    balances = {group_id: {} for group_id in group_ids}
+    rows = db.session.query(MemberBalance.group_id, MemberBalance.user_id, MemberBalance.balance).filter(
+        MemberBalance.group_id.in_(group_ids)
+    )
+    for group_id, user_id, balance in rows:
+        balances[group_id][user_id] = balance
+    return balances
+
+def replay_group_balances(group_id, through=None):
+    """Recompute balances from the latest checkpoint and the history after it.
     
-    # Calculate from expenses
-    for expense in expenses:
-        split_members = [int(x) for x in expense.split_members.split(',') if x]
-        split_amount = expense.amount / len(split_members)
-        
-        # Person who paid gets credited
-        if expense.paid_by not in balances:
-            balances[expense.paid_by] = 0
-        balances[expense.paid_by] += expense.amount
-        
-        # Each person who shared gets debited
-        for member_id in split_members:
-            if member_id not in balances:
-                balances[member_id] = 0
-            balances[member_id] -= split_amount
-    
-    # Subtract settlements
-    for settlement in settlements:
-        if settlement.from_user not in balances:
-            balances[settlement.from_user] = 0
-        if settlement.to_user not in balances:
-            balances[settlement.to_user] = 0
-            
-        balances[settlement.from_user] += settlement.amount
-        balances[settlement.to_user] -= settlement.amount
+    ``through`` is an optional ``(expense_id, settlement_id)`` pair to stop at.
+    """
+    checkpoint = latest_checkpoint(group_id)
+    expense_filter = [Expense.group_id == group_id]
+    settlement_filter = [Settlement.group_id == group_id]
+    if checkpoint is not None:
+        expense_filter.append(Expense.id > checkpoint.expense_id)
+        settlement_filter.append(Settlement.id > checkpoint.settlement_id)
+    if through is not None:
+        expense_filter.append(Expense.id <= through[0])
+        settlement_filter.append(Settlement.id <= through[1])
     
-    return balances
+    credits = db.session.query(
+        Expense.paid_by.label('user_id'), Expense.amount.label('delta')
+    ).filter(*expense_filter)
+    debits = db.session.query(
+        ExpenseShare.user_id, -ExpenseShare.share_amount
+    ).join(Expense).filter(*expense_filter)
+    paid = db.session.query(
+        Settlement.from_user, Settlement.amount
+    ).filter(*settlement_filter)
+    received = db.session.query(
+        Settlement.to_user, -Settlement.amount
+    ).filter(*settlement_filter)
+    parts = [credits, debits, paid, received]
+    if checkpoint is not None:
+        parts.append(db.session.query(CheckpointBalance.user_id, CheckpointBalance.balance).filter(
+            CheckpointBalance.checkpoint_id == checkpoint.id))
+    
+    movements = union_all(*parts).subquery()
+    rows = db.session.query(
+        movements.c.user_id, func.sum(movements.c.delta)
+    ).group_by(movements.c.user_id).all()
+    
+    return {user_id: balance for user_id, balance in rows}
 
-def calculate_settlements(balances):
-    """Calculate optimal settlements to minimize transactions"""
-    creditors = [(user_id, amount) for user_id, amount in balances.items() if amount > 0.01]
-    debtors = [(user_id, -amount) for user_id, amount in balances.items() if amount < -0.01]
+def split_amount(amount, count):
+    """Split an amount into ``count`` shares that add up to it exactly in cents"""
+    total_cents = int(round(amount * 100))
+    base, remainder = divmod(total_cents, count)
+    return [(base + (1 if i < remainder else 0)) / 100 for i in range(count)]
+
+def build_expense_shares(amount, member_ids):
+    """Build ExpenseShare rows splitting ``amount`` equally between members"""
+    member_ids = list(dict.fromkeys(member_ids))
+    if not member_ids:
+        return []
+    return [ExpenseShare(user_id=member_id, share_amount=share)
+            for member_id, share in zip(member_ids, split_amount(amount, len(member_ids)))]
+
+def expense_balance_deltas(expense):
+    """Return the balance change each member sees from a single expense"""
+    deltas = {}
     
-    settlements = []
+    # Person who paid gets credited
+    deltas[expense.paid_by] = expense.amount
     
-    creditors.sort(key=lambda x: x[1], reverse=True)
-    debtors.sort(key=lambda x: x[1], reverse=True)
+    # Each person who shared gets debited
+    for share in expense.shares:
+        deltas[share.user_id] = deltas.get(share.user_id, 0) - share.share_amount
     
-    i, j = 0, 0
-    while i < len(creditors) and j < len(debtors):
-        creditor_id, credit_amount = creditors[i]
-        debtor_id, debt_amount = debtors[j]
-        
-        settle_amount = min(credit_amount, debt_amount)
-        
-        if settle_amount > 0.01:
-            settlements.append({
-                'from_user': debtor_id,
-                'to_user': creditor_id,
-                'amount': round(settle_amount, 2)
-            })
-        
-        creditors[i] = (creditor_id, credit_amount - settle_amount)
-        debtors[j] = (debtor_id, debt_amount - settle_amount)
-        
-        if creditors[i][1] < 0.01:
-            i += 1
-        if debtors[j][1] < 0.01:
-            j += 1
+    return deltas
+
+def settlement_balance_deltas(settlement):
+    """Return the balance change each member sees from a single settlement"""
+    deltas = {settlement.from_user: settlement.amount}
+    deltas[settlement.to_user] = deltas.get(settlement.to_user, 0) - settlement.amount
+    return deltas
+
+def upsert_increments(table, key_columns, rows):
+    """Add each row's other columns onto the row with the same key, inserting it if missing.
+    
+    Done as one INSERT ... ON CONFLICT DO UPDATE (ON DUPLICATE KEY UPDATE on
+    MySQL) so concurrent first writes to a key add up instead of failing on
+    the unique constraint. ``key_columns`` must match a unique constraint
+    and every row must have the same columns.
+    """
+    increments = [name for name in rows[0] if name not in key_columns]
+    dialect = db.engine.dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        stmt = mysql.insert(table)
+        stmt = stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in increments})
+    else:
+        stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=key_columns,
+                                          set_={name: table.c[name] + stmt.excluded[name] for name in increments})
+    db.session.execute(stmt, rows)
+
+def apply_balance_deltas(group_id, deltas):
+    """Add deltas to the materialized ledger inside the current transaction.
+    
+    The addition is done in SQL (``balance = balance + delta``) as an upsert,
+    so concurrent writers neither lose updates nor collide creating a row.
+    """
+    if not deltas:
+        return
+    
+    upsert_increments(MemberBalance.__table__, ['group_id', 'user_id'],
+                      [{'group_id': group_id, 'user_id': user_id, 'balance': delta}
+                       for user_id, delta in deltas.items()])
+    queue_group_event(group_id, {'type': 'balances',
+                                 'deltas': {user_id: round(delta, 2) for user_id, delta in deltas.items()}})
+
+def apply_expense_to_ledger(expense, sign=1):
+    """Apply (sign=1) or revert (sign=-1) an expense on the ledger and group totals"""
+    deltas = expense_balance_deltas(expense)
+    apply_balance_deltas(expense.group_id, {k: sign * v for k, v in deltas.items()})
+    apply_group_totals(expense.group_id, sign, sign * expense.amount)
+    shares = [(share.user_id, share.share_amount) for share in expense.shares]
+    apply_rollup_deltas(expense.group_id, expense_rollup_deltas(
+        expense.date, expense.paid_by, expense.amount, shares, sign))
+    apply_pair_deltas(expense.group_id, expense_pair_deltas(expense.paid_by, shares, sign))
+
+def apply_group_totals(group_id, count_delta, amount_delta):
+    """Adjust a group's running expense totals and bump its version"""
+    table = Group.__table__
+    db.session.execute(
+        table.update().where(table.c.id == group_id).values(
+            expense_count=table.c.expense_count + count_delta,
+            total_spent=table.c.total_spent + amount_delta,
+            version=table.c.version + 1,
+            updated_at=datetime.utcnow()
+        )
+    )
+
+def refresh_group_totals(group_id=None):
+    """Recompute the cached expense count and total for one or all groups, archive included"""
+    table = Group.__table__
+    
+    def total(aggregate):
+        return sum(select(aggregate(expenses.c)).where(expenses.c.group_id == table.c.id).scalar_subquery()
+                   for expenses in (Expense.__table__, ArchivedExpense.__table__))
+    
+    stmt = table.update().values(
+        expense_count=total(lambda c: func.count(c.id)),
+        total_spent=total(lambda c: func.coalesce(func.sum(c.amount), 0))
+    )
+    if group_id is not None:
+        stmt = stmt.where(table.c.id == group_id)
+    db.session.execute(stmt)
+
+def apply_settlement_to_ledger(settlement, sign=1):
+    """Apply (sign=1) or revert (sign=-1) a settlement on the ledger"""
+    deltas = settlement_balance_deltas(settlement)
+    apply_balance_deltas(settlement.group_id, {k: sign * v for k, v in deltas.items()})
+    month = rollup_month(settlement.date)
+    apply_rollup_deltas(settlement.group_id, {
+        (settlement.from_user, month): {'settled_out': sign * settlement.amount},
+        (settlement.to_user, month): {'settled_in': sign * settlement.amount},
+    })
+    apply_pair_deltas(settlement.group_id, {(settlement.from_user, settlement.to_user): sign * settlement.amount})
+    bump_group_version(settlement.group_id)
+
+def expense_pair_deltas(paid_by, shares, sign=1, into=None):
+    """Pairwise changes from one expense as ``{(user_id, counterparty_id): delta}``.
+    
+    Everyone with a share now owes the payer that share; merged into
+    ``into`` when given.
+    """
+    deltas = {} if into is None else into
+    for user_id, share in shares:
+        if user_id != paid_by:
+            deltas[(paid_by, user_id)] = deltas.get((paid_by, user_id), 0) + sign * share
+    return deltas
+
+def mirror_pairs(deltas):
+    """Add the other side of every pair, with the opposite sign"""
+    mirrored = {}
+    for (user_id, counterparty_id), delta in deltas.items():
+        if user_id == counterparty_id or not delta:
+            continue
+        mirrored[(user_id, counterparty_id)] = mirrored.get((user_id, counterparty_id), 0) + delta
+        mirrored[(counterparty_id, user_id)] = mirrored.get((counterparty_id, user_id), 0) - delta
+    return mirrored
+
+def apply_pair_deltas(group_id, deltas):
+    """Add pairwise deltas to the index inside the current transaction, like apply_balance_deltas"""
+    deltas = mirror_pairs(deltas)
+    if not deltas:
+        return
+    
+    upsert_increments(PairwiseBalance.__table__, ['group_id', 'user_id', 'counterparty_id'],
+                      [{'group_id': group_id, 'user_id': user_id, 'counterparty_id': counterparty_id, 'amount': delta}
+                       for (user_id, counterparty_id), delta in deltas.items()])
+
+def fold_pairs(user_id, positions):
+    """Pass a departing member's debts on: whoever owed them now owes their creditors.
+    
+    ``positions`` maps counterparty to what they owe ``user_id``. Returns the
+    pairwise deltas between the remaining members, matching the largest
+    debts first.
+    """
+    debtors = sorted(([counterparty, amount] for counterparty, amount in positions.items() if amount > 0),
+                     key=lambda item: -item[1])
+    creditors = sorted(([counterparty, -amount] for counterparty, amount in positions.items() if amount < 0),
+                       key=lambda item: -item[1])
+    deltas = {}
+    while debtors and creditors:
+        debtor, creditor = debtors[0], creditors[0]
+        amount = min(debtor[1], creditor[1])
+        deltas[(creditor[0], debtor[0])] = deltas.get((creditor[0], debtor[0]), 0) + amount
+        debtor[1] -= amount
+        creditor[1] -= amount
+        if debtor[1] < 0.005:
+            debtors.pop(0)
+        if creditor[1] < 0.005:
+            creditors.pop(0)
+    return deltas
+
+def remove_member_pairs(group_id, user_id):
+    """Drop a departing member from the pairwise index, folding their debts into the others'"""
+    positions = dict(db.session.query(PairwiseBalance.counterparty_id, PairwiseBalance.amount).filter(
+        PairwiseBalance.group_id == group_id, PairwiseBalance.user_id == user_id
+    ).all())
+    PairwiseBalance.query.filter(
+        PairwiseBalance.group_id == group_id,
+        or_(PairwiseBalance.user_id == user_id, PairwiseBalance.counterparty_id == user_id)
+    ).delete(synchronize_session=False)
+    apply_pair_deltas(group_id, fold_pairs(user_id, positions))
+
+def rebuild_group_pairs(group_id):
+    """Recompute a group's pairwise index from its full history, archive included.
+    
+    Debts of people who have since left are folded into the remaining
+    members' as they would have been on leaving; the order can differ, but
+    every member's total is the same.
+    """
+    deltas = {}
+    histories = [HOT_HISTORY]
+    if group_has_archive(group_id):
+        histories.append(ARCHIVED_HISTORY)
+    for expense, share, settlement in histories:
+        rows = db.session.query(expense.paid_by, share.user_id, func.sum(share.share_amount)).join(
+            expense, expense.id == share.expense_id
+        ).filter(expense.group_id == group_id, share.user_id != expense.paid_by).group_by(
+            expense.paid_by, share.user_id)
+        rows = rows.union_all(db.session.query(
+            settlement.from_user, settlement.to_user, func.sum(settlement.amount)
+        ).filter(settlement.group_id == group_id).group_by(settlement.from_user, settlement.to_user))
+        for user_id, counterparty_id, amount in rows:
+            deltas[(user_id, counterparty_id)] = deltas.get((user_id, counterparty_id), 0) + amount
+    pairs = mirror_pairs(deltas)
+    
+    members = {user_id for (user_id,) in db.session.query(GroupMember.user_id).filter(
+        GroupMember.group_id == group_id
+    )}
+    for departed in sorted({user_id for user_id, _ in pairs} - members):
+        positions = {counterparty_id: amount for (user_id, counterparty_id), amount in pairs.items()
+                     if user_id == departed}
+        pairs = {pair: amount for pair, amount in pairs.items() if departed not in pair}
+        for pair, amount in mirror_pairs(fold_pairs(departed, positions)).items():
+            pairs[pair] = pairs.get(pair, 0) + amount
+    
+    PairwiseBalance.query.filter_by(group_id=group_id).delete()
+    rows = [{'group_id': group_id, 'user_id': user_id, 'counterparty_id': counterparty_id, 'amount': amount}
+            for (user_id, counterparty_id), amount in pairs.items() if abs(amount) >= 0.005]
+    if rows:
+        db.session.execute(PairwiseBalance.__table__.insert(), rows)
+    return len(rows)
+
+@timed('positions')
+def get_user_positions(user_id):
+    """What each counterparty owes a user, summed over all their groups in one query.
+    
+    Returns ``{'owed_to_you', 'you_owe', 'net', 'counterparties'}`` with
+    counterparties ordered by the size of the net amount.
+    """
+    net = func.sum(PairwiseBalance.amount)
+    rows = db.session.query(
+        PairwiseBalance.counterparty_id, User.name, net, func.count(PairwiseBalance.group_id)
+    ).join(User, User.id == PairwiseBalance.counterparty_id).filter(
+        PairwiseBalance.user_id == user_id,
+        func.abs(PairwiseBalance.amount) >= 0.005
+    ).group_by(PairwiseBalance.counterparty_id, User.name).having(func.abs(net) >= 0.005).all()
+    
+    counterparties = sorted(({
+        'user_id': counterparty_id,
+        'name': name,
+        'net': round(amount, 2),
+        'group_count': groups
+    } for counterparty_id, name, amount, groups in rows), key=lambda item: (-abs(item['net']), item['user_id']))
+    owed_to_you = round(sum(item['net'] for item in counterparties if item['net'] > 0), 2)
+    you_owe = round(-sum(item['net'] for item in counterparties if item['net'] < 0), 2)
+    return {
+        'owed_to_you': owed_to_you,
+        'you_owe': you_owe,
+        'net': round(owed_to_you - you_owe, 2),
+        'counterparties': counterparties
+    }
+
+def parse_month(value):
+    """Validate a 'YYYY-MM' query argument, passing None through"""
+    if value is None:
+        return None
+    if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', value):
+        raise ValueError(f'Invalid month {value!r}')
+    return value
+
+def filter_months(query, since, until):
+    if since:
+        query = query.filter(MonthlyRollup.month >= since)
+    if until:
+        query = query.filter(MonthlyRollup.month <= until)
+    return query
+
+def rollup_sums():
+    return [func.sum(getattr(MonthlyRollup, field)) for field in ROLLUP_FIELDS]
+
+def rollup_row(values, **extra):
+    row = {field: round(value or 0, 2) for field, value in zip(ROLLUP_FIELDS, values)}
+    row['expense_count'] = int(row['expense_count'])
+    row.update(extra)
+    return row
+
+@timed('analytics')
+def group_monthly_totals(group_id, since=None, until=None):
+    """A group's totals per month, read from the rollups only"""
+    query = filter_months(db.session.query(MonthlyRollup.month, *rollup_sums()).filter(
+        MonthlyRollup.group_id == group_id), since, until)
+    return [rollup_row(values, month=month)
+            for month, *values in query.group_by(MonthlyRollup.month).order_by(MonthlyRollup.month)]
+
+@timed('analytics')
+def group_member_totals(group_id, since=None, until=None):
+    """Each member's totals over a month range, as ``{user_id: totals}``"""
+    query = filter_months(db.session.query(MonthlyRollup.user_id, *rollup_sums()).filter(
+        MonthlyRollup.group_id == group_id), since, until)
+    return {user_id: rollup_row(values) for user_id, *values in query.group_by(MonthlyRollup.user_id)}
+
+@timed('analytics')
+def user_monthly_totals(user_id, since=None, until=None):
+    """A user's totals per month summed over all their groups"""
+    query = filter_months(db.session.query(MonthlyRollup.month, *rollup_sums()).filter(
+        MonthlyRollup.user_id == user_id), since, until)
+    return [rollup_row(values, month=month)
+            for month, *values in query.group_by(MonthlyRollup.month).order_by(MonthlyRollup.month)]
+
+def rollup_month(date):
+    return (date or datetime.utcnow()).strftime('%Y-%m')
+
+def expense_rollup_deltas(date, paid_by, amount, shares, sign=1, into=None):
+    """Rollup deltas for one expense, merged into ``into`` when given"""
+    deltas = {} if into is None else into
+    month = rollup_month(date)
+    payer = deltas.setdefault((paid_by, month), {})
+    payer['paid'] = payer.get('paid', 0) + sign * amount
+    payer['expense_count'] = payer.get('expense_count', 0) + sign
+    for user_id, share in shares:
+        member = deltas.setdefault((user_id, month), {})
+        member['owed'] = member.get('owed', 0) + sign * share
+    return deltas
+
+def apply_rollup_deltas(group_id, deltas):
+    """Add ``{(user_id, month): {field: delta}}`` to the monthly rollups in SQL"""
+    if not deltas:
+        return
+    
+    upsert_increments(MonthlyRollup.__table__, ['group_id', 'month', 'user_id'], [
+        dict({field: values.get(field, 0) for field in ROLLUP_FIELDS},
+             group_id=group_id, user_id=user_id, month=month)
+        for (user_id, month), values in deltas.items()
+    ])
+
+def month_of(column):
+    """SQL expression formatting a datetime column as 'YYYY-MM'"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return func.strftime('%Y-%m', column)
+    if dialect in ('mysql', 'mariadb'):
+        return func.date_format(column, '%Y-%m')
+    return func.to_char(column, 'YYYY-MM')
+
+def rebuild_group_rollups(group_id):
+    """Recompute a group's monthly rollups from its full history, archive included"""
+    totals = {}
+    
+    def add(rows, field):
+        for user_id, month, value in rows:
+            values = totals.setdefault((user_id, month), {})
+            values[field] = values.get(field, 0) + value
+    
+    histories = [HOT_HISTORY]
+    if group_has_archive(group_id):
+        histories.append(ARCHIVED_HISTORY)
+    for expense, share, settlement in histories:
+        expense_month = month_of(expense.date)
+        add(db.session.query(expense.paid_by, expense_month, func.sum(expense.amount)).filter(
+            expense.group_id == group_id).group_by(expense.paid_by, expense_month), 'paid')
+        add(db.session.query(expense.paid_by, expense_month, func.count(expense.id)).filter(
+            expense.group_id == group_id).group_by(expense.paid_by, expense_month), 'expense_count')
+        add(db.session.query(share.user_id, expense_month, func.sum(share.share_amount)).join(
+            expense, expense.id == share.expense_id).filter(expense.group_id == group_id).group_by(
+            share.user_id, expense_month), 'owed')
+        settlement_month = month_of(settlement.date)
+        add(db.session.query(settlement.from_user, settlement_month, func.sum(settlement.amount)).filter(
+            settlement.group_id == group_id).group_by(settlement.from_user, settlement_month), 'settled_out')
+        add(db.session.query(settlement.to_user, settlement_month, func.sum(settlement.amount)).filter(
+            settlement.group_id == group_id).group_by(settlement.to_user, settlement_month), 'settled_in')
+    
+    MonthlyRollup.query.filter_by(group_id=group_id).delete()
+    if totals:
+        db.session.execute(MonthlyRollup.__table__.insert(), [
+            dict({field: values.get(field, 0) for field in ROLLUP_FIELDS},
+                 group_id=group_id, user_id=user_id, month=month)
+            for (user_id, month), values in totals.items()
+        ])
+    db.session.commit()
+    return len(totals)
+
+def bump_group_version(group_id):
+    """Mark a group's data as changed so version-keyed caches miss"""
+    table = Group.__table__
+    db.session.execute(
+        table.update().where(table.c.id == group_id).values(version=table.c.version + 1,
+                                                            updated_at=datetime.utcnow())
+    )
+
+def rebuild_group_ledger(group_id, fix=True, tolerance=0.005):
+    """Compare the ledger against a full replay and optionally rewrite it.
+    
+    Returns a list of ``(user_id, ledger_balance, replayed_balance)`` tuples
+    for every member whose stored balance drifted beyond ``tolerance``.
+    """
+    stored = calculate_group_balances(group_id)
+    replayed = replay_group_balances(group_id)
     
-    return settlements
+    drift = []
+    for user_id in sorted(set(stored) | set(replayed)):
+        ledger_balance = stored.get(user_id, 0)
+        replayed_balance = replayed.get(user_id, 0)
+        if abs(ledger_balance - replayed_balance) > tolerance:
+            drift.append((user_id, ledger_balance, replayed_balance))
+    
+    if fix:
+        member_ids = group_member_ids(group_id)
+        MemberBalance.query.filter_by(group_id=group_id).delete()
+        for user_id, balance in replayed.items():
+            # Members who left did so at zero; only real money keeps a row for them
+            if user_id in member_ids or round(balance * 100) != 0:
+                db.session.add(MemberBalance(group_id=group_id, user_id=user_id, balance=balance))
+        rebuild_group_pairs(group_id)
+        refresh_group_totals(group_id)
+        bump_group_version(group_id)
+        db.session.commit()
+    
+    return drift
+
+def latest_checkpoint(group_id):
+    return BalanceCheckpoint.query.filter_by(group_id=group_id).order_by(BalanceCheckpoint.id.desc()).first()
+
+def group_has_archive(group_id):
+    """Whether any of the group's history has been moved to the archive tables"""
+    return db.session.query(BalanceCheckpoint.query.filter(
+        BalanceCheckpoint.group_id == group_id,
+        BalanceCheckpoint.archived_at.isnot(None)
+    ).exists()).scalar()
+
+def tables_reusing_ids():
+    """History tables SQLite created without AUTOINCREMENT, which hand out the ids of deleted rows again"""
+    if db.engine.dialect.name != 'sqlite':
+        return []
+    names = {model.__tablename__ for model in HOT_HISTORY}
+    rows = db.session.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'table'"))
+    return sorted(name for name, sql in rows if name in names and 'AUTOINCREMENT' not in sql.upper())
+
+def history_cutoff(model, group_id, before):
+    """Highest id such that every row of the group up to it is dated before ``before``"""
+    first_recent = db.session.query(func.min(model.id)).filter(
+        model.group_id == group_id, model.date >= before
+    ).scalar()
+    if first_recent is not None:
+        return first_recent - 1
+    return db.session.query(func.max(model.id)).filter(model.group_id == group_id).scalar() or 0
+
+def create_balance_checkpoint(group_id, before):
+    """Checkpoint a group's balances over its history dated before ``before``.
+    
+    Returns the new checkpoint, or None when nothing new is old enough.
+    """
+    previous = latest_checkpoint(group_id)
+    through = (history_cutoff(Expense, group_id, before), history_cutoff(Settlement, group_id, before))
+    if previous is not None:
+        through = (max(through[0], previous.expense_id), max(through[1], previous.settlement_id))
+        if through == (previous.expense_id, previous.settlement_id):
+            return None
+    elif through == (0, 0):
+        return None
+    
+    balances = replay_group_balances(group_id, through)
+    checkpoint = BalanceCheckpoint(group_id=group_id, expense_id=through[0], settlement_id=through[1])
+    checkpoint.balances = [CheckpointBalance(user_id=user_id, balance=balance)
+                           for user_id, balance in balances.items()]
+    db.session.add(checkpoint)
+    db.session.commit()
+    return checkpoint
+
+def archive_group_history(group_id, batch_size=None):
+    """Move the expenses and settlements covered by the latest checkpoint to the archive tables.
+    
+    Works in batches, one transaction each. Returns ``(expenses, settlements)`` moved.
+    """
+    # Archived ids handed out again would sort under the checkpoint and drop out of replays
+    reused = tables_reusing_ids()
+    if reused:
+        raise RuntimeError(f'{", ".join(reused)} reuse deleted ids; run "flask init-db" to recreate them '
+                           f'with AUTOINCREMENT before archiving')
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    checkpoint = latest_checkpoint(group_id)
+    if checkpoint is None:
+        return 0, 0
+    
+    def copy_rows(model, archive_model, condition):
+        names = [column.name for column in archive_model.__table__.columns]
+        db.session.execute(archive_model.__table__.insert().from_select(
+            names, select(*(model.__table__.c[name] for name in names)).where(condition)))
+    
+    def move(model, archive_model, through, children=None):
+        moved = 0
+        while True:
+            ids = [row_id for (row_id,) in db.session.query(model.id).filter(
+                model.group_id == group_id, model.id <= through
+            ).order_by(model.id).limit(batch_size)]
+            if not ids:
+                return moved
+            # Parents are copied before their children and deleted after them,
+            # so foreign keys hold at every statement
+            copy_rows(model, archive_model, model.id.in_(ids))
+            if children is not None:
+                child, archive_child = children
+                copy_rows(child, archive_child, child.expense_id.in_(ids))
+                db.session.execute(child.__table__.delete().where(child.expense_id.in_(ids)))
+            db.session.execute(model.__table__.delete().where(model.id.in_(ids)))
+            # Flagged in the same transaction as the first batch, so readers that
+            # check group_has_archive never miss moved rows
+            checkpoint.archived_at = checkpoint.archived_at or datetime.utcnow()
+            db.session.commit()
+            moved += len(ids)
+    
+    expenses = move(Expense, ArchivedExpense, checkpoint.expense_id, (ExpenseShare, ArchivedExpenseShare))
+    settlements = move(Settlement, ArchivedSettlement, checkpoint.settlement_id)
+    if expenses or settlements:
+        bump_group_version(group_id)
+        db.session.commit()
+    return expenses, settlements
+
+@timed('settlements')
+def calculate_settlements(balances, strategy=None):
+    """Calculate settlements that even out balances with as few transfers as possible"""
+    return plan_settlements(
+        balances,
+        strategy=strategy or current_app.config['SETTLEMENT_STRATEGY'],
+        exact_limit=current_app.config['SETTLEMENT_EXACT_LIMIT'],
+        time_budget=current_app.config['SETTLEMENT_TIME_BUDGET']
+    )
+
+def add_missing_columns():
+    """Add model columns missing from existing tables and return their names"""
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            preparer = db.engine.dialect.identifier_preparer
+            ddl = (f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} '
+                   f'{column.type.compile(dialect=db.engine.dialect)}')
+            if column.server_default is not None:
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+                ddl += f' DEFAULT {column.server_default.arg}'
+            with db.engine.begin() as conn:
+                conn.execute(text(ddl))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+def rebuild_autoincrement_tables():
+    """Recreate SQLite history tables made without AUTOINCREMENT, keeping their rows, indexes and triggers.
+    
+    The new id sequence starts above every id already used, archived rows
+    included. Returns the names of the rebuilt tables.
+    """
+    rebuilt = tables_reusing_ids()
+    archives = {model.__tablename__: archive for model, archive in zip(HOT_HISTORY, ARCHIVED_HISTORY)}
+    with db.engine.connect() as conn:
+        # Dropping a parent table with foreign keys on would cascade to its children
+        foreign_keys = conn.exec_driver_sql('PRAGMA foreign_keys').scalar()
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        conn.commit()
+        try:
+            for name in rebuilt:
+                table = db.metadata.tables[name]
+                staging = table.to_metadata(db.metadata, name=f'{name}_rebuild')
+                try:
+                    triggers = conn.exec_driver_sql(
+                        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (name,)
+                    ).scalars().all()
+                    high = max(conn.execute(select(func.max(archives[name].id))).scalar() or 0,
+                               conn.execute(select(func.max(table.c.id))).scalar() or 0)
+                    columns = [column.name for column in table.columns]
+                    conn.exec_driver_sql('BEGIN')
+                    conn.execute(CreateTable(staging))
+                    conn.execute(staging.insert().from_select(columns, select(*table.c)))
+                    conn.execute(DropTable(table))
+                    conn.exec_driver_sql(f'ALTER TABLE {staging.name} RENAME TO {name}')
+                    for index in table.indexes:
+                        index.create(conn)
+                    for trigger in triggers:
+                        conn.exec_driver_sql(trigger)
+                    conn.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ?', (name,))
+                    conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (name, high))
+                    conn.commit()
+                finally:
+                    db.metadata.remove(staging)
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql(f'PRAGMA foreign_keys={foreign_keys}')
+            conn.commit()
+    return rebuilt
+
+def create_missing_indexes():
+    """Create model indexes that predate their table (create_all skips those)"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def backfill_expense_shares(batch_size=1000):
+    """Insert share rows for expenses created before ExpenseShare existed"""
+    has_shares = db.session.query(ExpenseShare.expense_id).distinct()
+    pending = db.session.query(Expense.id, Expense.amount, Expense.split_members).filter(
+        Expense.id.notin_(has_shares)
+    ).order_by(Expense.id).all()
+    
+    table = ExpenseShare.__table__
+    for start in range(0, len(pending), batch_size):
+        rows = []
+        for expense_id, amount, split_members in pending[start:start + batch_size]:
+            member_ids = list(dict.fromkeys(int(x) for x in split_members.split(',') if x))
+            if not member_ids:
+                continue
+            for member_id, share in zip(member_ids, split_amount(amount, len(member_ids))):
+                rows.append({'expense_id': expense_id, 'user_id': member_id, 'share_amount': share})
+        if rows:
+            db.session.execute(table.insert(), rows)
+        db.session.commit()
+    
+    return len(pending)
+
+@main.cli.command('init-db')
+def init_db_command():
+    """Create missing tables, columns and indexes, then backfill derived data."""
+    db.create_all()
+    added = add_missing_columns()
+    rebuild_autoincrement_tables()
+    create_missing_indexes()
+    create_search_index()
+    if 'group.total_spent' in added:
+        refresh_group_totals()
+        db.session.commit()
+    backfill_expense_shares()
+    
+    seeded = db.session.query(MemberBalance.group_id).distinct()
+    for (group_id,) in db.session.query(Group.id).filter(Group.id.notin_(seeded)).all():
+        rebuild_group_ledger(group_id)
+    
+    rolled_up = db.session.query(MonthlyRollup.group_id).distinct()
+    for (group_id,) in db.session.query(Expense.group_id).filter(Expense.group_id.notin_(rolled_up)).distinct().all():
+        rebuild_group_rollups(group_id)
+    
+    # Groups with archived history may have no live expenses left, so pick them from the ledger
+    indexed = db.session.query(PairwiseBalance.group_id).distinct()
+    for (group_id,) in db.session.query(MemberBalance.group_id).filter(
+        MemberBalance.group_id.notin_(indexed)
+    ).distinct().all():
+        rebuild_group_pairs(group_id)
+        db.session.commit()
+    click.echo('Database initialized.')
+
+@main.cli.command('import-expenses')
+@click.argument('group_id', type=int)
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, help='Rows per INSERT batch.')
+@click.option('--strict', is_flag=True, help='Import nothing if any row is invalid.')
+def import_expenses_command(group_id, source, fmt, batch_size, strict):
+    """Bulk import expenses into a group from a CSV or JSON file."""
+    if db.session.get(Group, group_id) is None:
+        raise click.ClickException(f'Group {group_id} does not exist')
+    
+    fmt = fmt or ('json' if source.name.endswith('.json') else 'csv')
+    if fmt == 'json':
+        data = json.load(source)
+        records = data.get('expenses', []) if isinstance(data, dict) else data
+    else:
+        records = read_expense_csv(source)
+    
+    started = time.perf_counter()
+    imported, errors = import_expenses(group_id, records, batch_size=batch_size, strict=strict)
+    for error in errors:
+        click.echo(f'row {error["row"]}: {error["message"]}', err=True)
+    click.echo(f'Imported {imported} expense(s) in {time.perf_counter() - started:.2f}s, '
+               f'{len(errors)} row(s) rejected.')
+
+@main.cli.command('backfill-shares')
+@click.option('--batch-size', default=1000, show_default=True)
+def backfill_shares_command(batch_size):
+    """Create ExpenseShare rows for expenses that only have split_members."""
+    db.create_all()
+    count = backfill_expense_shares(batch_size)
+    click.echo(f'Backfilled shares for {count} expense(s). '
+               f'Run "flask rebuild-ledger" to pick up rounding changes.')
+
+@main.cli.command('rebuild-ledger')
+@click.option('--group', 'group_ids', type=int, multiple=True, help='Only check these group ids.')
+@click.option('--verify-only', is_flag=True, help='Report drift without rewriting the ledger.')
+def rebuild_ledger_command(group_ids, verify_only):
+    """Recompute member balances from history and report any drift."""
+    db.create_all()
+    if not group_ids:
+        group_ids = [group_id for (group_id,) in db.session.query(Group.id).order_by(Group.id)]
+    
+    drifted_groups = 0
+    for group_id in group_ids:
+        drift = rebuild_group_ledger(group_id, fix=not verify_only)
+        if drift:
+            drifted_groups += 1
+            for user_id, ledger_balance, replayed_balance in drift:
+                click.echo(f'group {group_id} user {user_id}: ledger {ledger_balance:.2f} '
+                           f'!= history {replayed_balance:.2f}')
+    
+    action = 'checked' if verify_only else 'rebuilt'
+    click.echo(f'{len(group_ids)} group(s) {action}, {drifted_groups} with drift.')
+    if verify_only and drifted_groups:
+        raise SystemExit(1)
+
+@main.cli.command('backfill-rollups')
+@click.option('--group', 'group_ids', type=int, multiple=True, help='Only rebuild these group ids.')
+def backfill_rollups_command(group_ids):
+    """Rebuild the monthly analytics rollups from expense and settlement history."""
+    db.create_all()
+    if not group_ids:
+        group_ids = [group_id for (group_id,) in db.session.query(Group.id).order_by(Group.id)]
+    
+    rows = sum(rebuild_group_rollups(group_id) for group_id in group_ids)
+    click.echo(f'Rebuilt {rows} rollup row(s) for {len(group_ids)} group(s).')
+
+@main.cli.command('checkpoint-balances')
+@click.option('--group', 'group_ids', type=int, multiple=True, help='Only checkpoint these group ids.')
+@click.option('--min-age-days', type=int, help='Only cover history older than this.')
+def checkpoint_balances_command(group_ids, min_age_days):
+    """Snapshot member balances over old history so replays can start there."""
+    db.create_all()
+    if not group_ids:
+        group_ids = [group_id for (group_id,) in db.session.query(Group.id).order_by(Group.id)]
+    if min_age_days is None:
+        min_age_days = current_app.config['CHECKPOINT_MIN_AGE_DAYS']
+    
+    before = datetime.utcnow() - timedelta(days=min_age_days)
+    created = sum(create_balance_checkpoint(group_id, before) is not None for group_id in group_ids)
+    click.echo(f'Checkpointed {created} of {len(group_ids)} group(s).')
+
+@main.cli.command('archive-history')
+@click.option('--group', 'group_ids', type=int, multiple=True, help='Only archive these group ids.')
+@click.option('--batch-size', type=int, help='Rows moved per transaction.')
+def archive_history_command(group_ids, batch_size):
+    """Move checkpointed expenses and settlements to the archive tables."""
+    db.create_all()
+    if not group_ids:
+        group_ids = [group_id for (group_id,) in db.session.query(BalanceCheckpoint.group_id).distinct()]
+    
+    expenses = settlements = 0
+    for group_id in group_ids:
+        try:
+            moved_expenses, moved_settlements = archive_group_history(group_id, batch_size)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        expenses += moved_expenses
+        settlements += moved_settlements
+    click.echo(f'Archived {expenses} expense(s) and {settlements} settlement(s) from {len(group_ids)} group(s).')
+
+@main.cli.command('prune-idempotency-keys')
+def prune_idempotency_keys_command():
+    """Delete stored idempotency keys older than IDEMPOTENCY_KEY_TTL."""
+    db.create_all()
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete()
+    db.session.commit()
+    click.echo(f'Deleted {deleted} idempotency key(s).')
+
+def create_app(config=Config):
+    """Build the application from a config object (``Config`` by default)"""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    if not app.config['REPORT_CACHE_DIR']:
+        app.config['REPORT_CACHE_DIR'] = os.path.join(app.instance_path, 'reports')
+    
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+    
+    app.extensions['user_cache'] = TTLCache(max_entries=app.config['AUTH_CACHE_SIZE'],
+                                            ttl=app.config['AUTH_CACHE_TTL'])
+    app.extensions['membership_cache'] = TTLCache(max_entries=app.config['AUTH_CACHE_SIZE'],
+                                                  ttl=app.config['AUTH_CACHE_TTL'])
+    broker = Broker(max_queue=app.config['EVENT_QUEUE_SIZE'])
+    app.extensions['event_broker'] = broker
+    app.extensions['event_backend'] = LocalBackend(broker)
+    
+    app.extensions['password_hasher'] = PasswordHasher(method=app.config['PASSWORD_HASH_METHOD'],
+                                                       salt_length=app.config['PASSWORD_SALT_LENGTH'],
+                                                       max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                                       max_pending=app.config['PASSWORD_HASH_QUEUE_SIZE'])
+    app.extensions['report_queue'] = JobQueue(max_workers=app.config['REPORT_WORKERS'],
+                                              max_pending=app.config['REPORT_QUEUE_SIZE'])
+    app.extensions['report_cache'] = ArtifactCache(app.config['REPORT_CACHE_DIR'],
+                                                   max_bytes=app.config['REPORT_CACHE_MAX_BYTES'],
+                                                   max_age=app.config['REPORT_CACHE_MAX_AGE'])
+    app.extensions['fragment_cache'] = TieredCache(TTLCache(max_entries=app.config['FRAGMENT_CACHE_SIZE'],
+                                                            ttl=app.config['FRAGMENT_CACHE_TTL']))
+    if app.config['WRITE_COALESCE_MS']:
+        app.extensions['write_coalescer'] = WriteCoalescer(functools.partial(run_write_batch, app),
+                                                           window=app.config['WRITE_COALESCE_MS'] / 1000,
+                                                           max_batch=app.config['WRITE_COALESCE_MAX_BATCH'],
+                                                           max_pending=app.config['WRITE_QUEUE_SIZE'])
+    
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', sqlite_pragma_listener(app.config['SQLITE_PRAGMAS']))
+        if app.config['EVENT_BACKEND'] == 'database':
+            app.extensions['event_backend'] = DatabaseBackend(broker, db.engine, GroupEvent.__table__,
+                                                              interval=app.config['EVENT_POLL_INTERVAL'],
+                                                              retention=app.config['EVENT_RETENTION'])
+        if app.config['FRAGMENT_CACHE_BACKEND'] == 'database':
+            app.extensions['fragment_cache'].shared = DatabaseCache(db.engine, FragmentCacheEntry.__table__,
+                                                                    ttl=app.config['FRAGMENT_CACHE_TTL'])
+    
+    return app
+
+def engine_options(config):
+    """SQLAlchemy engine options for the configured database"""
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    # In-memory SQLite uses a single shared connection, so there is no pool to size
+    if not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+        options['pool_size'] = config['DB_POOL_SIZE']
+        options['max_overflow'] = config['DB_MAX_OVERFLOW']
+    return options
+
+def sqlite_pragma_listener(pragmas):
+    """Return a connect listener that applies ``pragmas`` to each new SQLite connection"""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return set_pragmas
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         db.create_all()
     app.run(debug=True)
@@ -0,0 +1,25 @@
+"""Benchmarks and synthetic data for Splitly.
+
+``python -m benchmarks.run`` seeds a database with ``benchmarks.datagen`` and
+times the hot paths, writing JSON results that can be compared run to run.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(database_url, **overrides):
+    """Import the app module and build an app against ``database_url``.
+
+    Returns ``(module, app)``: the module holds the models and helpers, the
+    app provides the context to call them in.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as splitly
+    from config import Config
+
+    settings = dict(overrides, SQLALCHEMY_DATABASE_URI=database_url)
+    config = type('BenchmarkConfig', (Config,), settings)
+    return splitly, splitly.create_app(config)
@@ -0,0 +1,161 @@
+"""Benchmark read latency while a login storm is running.
+
+Usage:
+    python -m benchmarks.bench_login_storm [--storm-clients 16] [--duration 10]
+        [--hash-workers 2] [--hash-queue 32] [--output results.json]
+
+Starts the app on a local threaded server and keeps a few clients reading
+group pages. Their latency is measured first on a quiet server, then while
+``--storm-clients`` threads log in as fast as they can. Raising
+``--hash-workers`` and ``--hash-queue`` far enough approximates hashing on
+the request threads, for comparison.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from benchmarks import load_app
+from benchmarks.datagen import PASSWORD, Scale, populate
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * fraction))], 2)
+
+
+def summarize(samples):
+    return {
+        'requests': len(samples),
+        'p50_ms': percentile(samples, 0.50),
+        'p95_ms': percentile(samples, 0.95),
+        'p99_ms': percentile(samples, 0.99)
+    }
+
+
+def login_opener(base_url, email):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    post_login(opener, base_url, email)
+    return opener
+
+
+def post_login(opener, base_url, email):
+    """POST the login form and return the HTTP status"""
+    request = urllib.request.Request(f'{base_url}/login', method='POST',
+                                     data=json.dumps({'email': email, 'password': PASSWORD}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with opener.open(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def read_loop(opener, url, stop, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        with opener.open(url) as response:
+            response.read()
+        samples.append((time.perf_counter() - started) * 1000)
+
+
+def storm_loop(base_url, emails, stop, statuses, latencies):
+    opener = urllib.request.build_opener()
+    index = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        status = post_login(opener, base_url, emails[index % len(emails)])
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+        index += 1
+
+
+def run_phase(base_url, readers, urls, duration, storm_clients, emails):
+    stop = threading.Event()
+    read_samples, login_samples, statuses = [], [], {}
+    threads = [threading.Thread(target=read_loop, args=(opener, url, stop, read_samples))
+               for opener, url in zip(readers, urls)]
+    threads += [threading.Thread(target=storm_loop, args=(base_url, emails, stop, statuses, login_samples))
+                for _ in range(storm_clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    result = {'reads': summarize(read_samples)}
+    if storm_clients:
+        result['logins'] = dict(summarize(login_samples),
+                                statuses={str(status): count for status, count in sorted(statuses.items())})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4, help='Clients reading group pages.')
+    parser.add_argument('--storm-clients', type=int, default=16, help='Clients logging in during the storm.')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per phase.')
+    parser.add_argument('--hash-workers', type=int, default=2)
+    parser.add_argument('--hash-queue', type=int, default=32)
+    parser.add_argument('--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+
+    scale = Scale(groups=4, members_per_group=8, expenses_per_group=500,
+                  settlements_per_group=20, groups_per_user=2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        splitly, app = load_app(f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                                REPORT_CACHE_DIR=os.path.join(tmp, 'reports'),
+                                PASSWORD_HASH_WORKERS=args.hash_workers,
+                                PASSWORD_HASH_QUEUE_SIZE=args.hash_queue)
+        with app.app_context():
+            seeded = populate(splitly, scale)
+            members = {(group_id, user_id) for group_id, user_id in splitly.db.session.query(
+                splitly.GroupMember.group_id, splitly.GroupMember.user_id)}
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        try:
+            readers, urls = [], []
+            for index in range(args.readers):
+                group_id, user_id = sorted(members)[index % len(members)]
+                readers.append(login_opener(base_url, f'user{user_id}@example.com'))
+                urls.append(f'{base_url}/group/{group_id}')
+
+            emails = [f'user{user_id}@example.com' for user_id in seeded['user_ids']]
+            results = {
+                'quiet': run_phase(base_url, readers, urls, args.duration, 0, emails),
+                'storm': run_phase(base_url, readers, urls, args.duration, args.storm_clients, emails)
+            }
+        finally:
+            server.shutdown()
+
+    report = {'settings': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    print(f'{"phase":<8} {"reads":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"logins":>7} {"429s":>6}')
+    for phase, result in results.items():
+        reads, logins = result['reads'], result.get('logins', {})
+        print(f'{phase:<8} {reads["requests"]:>7} {reads["p50_ms"]:>8} {reads["p95_ms"]:>8} {reads["p99_ms"]:>8} '
+              f'{logins.get("requests", 0):>7} {logins.get("statuses", {}).get("429", 0):>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark PDF report rendering: wall time and peak RSS by expense count.
+
+Usage:
+    python -m benchmarks.bench_pdf [--sizes 1000 10000 100000] [--members 8]
+
+Seeding and rendering each run in their own subprocess so the peak RSS
+reported for a render is not inflated by the seeding step or earlier sizes.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import ROOT, load_app
+from benchmarks.datagen import Scale, populate
+
+
+def seed(db_path, expenses, members):
+    splitly, app = load_app(f'sqlite:///{db_path}')
+    scale = Scale(groups=1, members_per_group=members, expenses_per_group=expenses,
+                  settlements_per_group=0, groups_per_user=1)
+    with app.app_context():
+        populate(splitly, scale)
+
+
+def render(db_path):
+    splitly, app = load_app(f'sqlite:///{db_path}')
+    with app.app_context():
+        group_id = splitly.Group.query.first().id
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        with tempfile.TemporaryFile() as output:
+            splitly.build_group_report(group_id, output)
+            size = output.tell()
+        elapsed = time.perf_counter() - started
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    print(json.dumps({
+        'seconds': round(elapsed, 3),
+        'peak_rss_mb': round(peak * scale / 2**20, 1),
+        'render_rss_growth_mb': round((peak - baseline) * scale / 2**20, 1),
+        'pdf_mb': round(size / 2**20, 2)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--members', type=int, default=8)
+    parser.add_argument('--seed', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--render', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        return seed(args.db, args.seed, args.members)
+    if args.render:
+        return render(args.db)
+
+    print(f'{"expenses":>10} {"seconds":>9} {"peak MB":>9} {"growth MB":>10} {"pdf MB":>8}')
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_pdf', '--seed', str(size),
+                            '--members', str(args.members), '--db', db_path], cwd=ROOT, check=True)
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pdf', '--render', '--db', db_path],
+                                 cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f'{size:>10} {result["seconds"]:>9} {result["peak_rss_mb"]:>9} '
+                  f'{result["render_rss_growth_mb"]:>10} {result["pdf_mb"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark settlement strategies: transfer count and runtime by group size.
+
+Usage:
+    python -m benchmarks.bench_settlements [--sizes 10 100 1000] [--trials 5]
+
+Balances come from simulated expenses split within small circles of friends,
+which is what real groups look like and what leaves zero-sum subgroups for
+the optimizer to find.
+"""
+import argparse
+import random
+import time
+
+from settlement_engine import plan_settlements
+
+
+def simulate_balances(members, rng, expenses_per_member=5):
+    balances = {user_id: 0.0 for user_id in range(members)}
+    circles = [list(range(start, min(start + 4, members))) for start in range(0, members, 4)]
+    for _ in range(members * expenses_per_member):
+        circle = rng.choice(circles)
+        payer = rng.choice(circle)
+        split = rng.sample(circle, rng.randint(1, len(circle)))
+        amount = rng.choice([10, 20, 25, 40, 50, 60, 100, 120, 200])
+        balances[payer] += amount
+        for user_id in split:
+            balances[user_id] -= amount / len(split)
+    return balances
+
+
+def run(strategy, balances):
+    started = time.perf_counter()
+    transfers = plan_settlements(balances, strategy=strategy)
+    return len(transfers), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f'{"members":>8} {"greedy transfers":>17} {"optimal transfers":>18} '
+          f'{"greedy ms":>10} {"optimal ms":>11}')
+    for size in args.sizes:
+        totals = {'greedy': [0, 0.0], 'optimal': [0, 0.0]}
+        for _ in range(args.trials):
+            balances = simulate_balances(size, rng)
+            for strategy in totals:
+                count, seconds = run(strategy, balances)
+                totals[strategy][0] += count
+                totals[strategy][1] += seconds
+        greedy, optimal = totals['greedy'], totals['optimal']
+        print(f'{size:>8} {greedy[0] / args.trials:>17.1f} {optimal[0] / args.trials:>18.1f} '
+              f'{greedy[1] * 1000 / args.trials:>10.2f} {optimal[1] * 1000 / args.trials:>11.2f}')
+
+
+if __name__ == '__main__':
+    main()
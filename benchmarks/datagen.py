@@ -0,0 +1,120 @@
+"""Seeded synthetic data: users, groups, members, expenses and settlements.
+
+The same seed and scale always produce the same rows, so timings from
+different runs describe the same workload.
+"""
+import math
+import random
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+PASSWORD = 'benchmark'
+# Cycled through rather than drawn from ``rng`` so the rest of the data stays put
+DESCRIPTIONS = ('Groceries', 'Dinner out', 'Taxi home', 'Electricity bill', 'Movie tickets',
+                'Coffee run', 'Weekend trip fuel', 'Internet bill', 'Lunch', 'Hardware store')
+
+
+@dataclass
+class Scale:
+    groups: int = 20
+    members_per_group: int = 8
+    expenses_per_group: int = 2000
+    settlements_per_group: int = 50
+    groups_per_user: int = 10
+
+    @property
+    def users(self):
+        return max(self.members_per_group,
+                   math.ceil(self.groups * self.members_per_group / self.groups_per_user))
+
+    def to_dict(self):
+        return dict(asdict(self), users=self.users)
+
+
+def populate(splitly, scale, seed=42, batch_size=5000):
+    """Fill an empty database and return ``{'user_ids', 'group_ids', 'busiest_user'}``.
+
+    Must run inside an app context. Rows go in with batched core inserts and
+    the derived tables (shares, ledger, group totals, rollups, search index) are built the same way
+    the app builds them.
+    """
+    db = splitly.db
+    rng = random.Random(seed)
+    db.create_all()
+
+    password_hash = current_app.extensions['password_hasher'].hash(PASSWORD)
+    user_table = splitly.User.__table__
+    db.session.execute(user_table.insert(), [
+        {'id': i + 1, 'email': f'user{i + 1}@example.com', 'name': f'User {i + 1}',
+         'password_hash': password_hash, 'created_at': datetime(2020, 1, 1)}
+        for i in range(scale.users)
+    ])
+    user_ids = list(range(1, scale.users + 1))
+
+    group_table = splitly.Group.__table__
+    db.session.execute(group_table.insert(), [
+        {'id': g + 1, 'name': f'Group {g + 1}', 'description': 'Synthetic benchmark group',
+         'code': f'B{g + 1:05d}', 'created_by': user_ids[0], 'created_at': datetime(2020, 1, 1)}
+        for g in range(scale.groups)
+    ])
+    group_ids = list(range(1, scale.groups + 1))
+
+    memberships = {}
+    member_rows = []
+    for group_id in group_ids:
+        members = rng.sample(user_ids, scale.members_per_group)
+        memberships[group_id] = members
+        member_rows.extend({'group_id': group_id, 'user_id': user_id} for user_id in members)
+    db.session.execute(splitly.GroupMember.__table__.insert(), member_rows)
+    db.session.commit()
+
+    expense_table = splitly.Expense.__table__
+    share_table = splitly.ExpenseShare.__table__
+    settlement_table = splitly.Settlement.__table__
+    start = datetime(2020, 1, 1)
+    expense_id = 0
+    for group_id in group_ids:
+        members = memberships[group_id]
+        for offset in range(0, scale.expenses_per_group, batch_size):
+            expenses, shares = [], []
+            for i in range(offset, min(offset + batch_size, scale.expenses_per_group)):
+                expense_id += 1
+                split = rng.sample(members, rng.randint(1, len(members)))
+                amount = round(rng.uniform(5, 500), 2)
+                expenses.append({
+                    'id': expense_id, 'group_id': group_id,
+                    'description': f'{DESCRIPTIONS[i % len(DESCRIPTIONS)]} {i}',
+                    'amount': amount, 'paid_by': rng.choice(members),
+                    'split_members': ','.join(map(str, split)),
+                    'date': start + timedelta(minutes=i * 17)
+                })
+                for user_id, share in zip(split, splitly.split_amount(amount, len(split))):
+                    shares.append({'expense_id': expense_id, 'user_id': user_id, 'share_amount': share})
+            db.session.execute(expense_table.insert(), expenses)
+            db.session.execute(share_table.insert(), shares)
+
+        settlements = []
+        for i in range(scale.settlements_per_group):
+            from_user, to_user = rng.sample(members, 2)
+            settlements.append({
+                'group_id': group_id, 'from_user': from_user, 'to_user': to_user,
+                'amount': round(rng.uniform(5, 200), 2), 'date': start + timedelta(hours=i * 5)
+            })
+        if settlements:
+            db.session.execute(settlement_table.insert(), settlements)
+        db.session.commit()
+
+    for group_id in group_ids:
+        splitly.rebuild_group_ledger(group_id)
+        splitly.rebuild_group_rollups(group_id)
+    splitly.create_search_index()
+
+    counts = {}
+    for members in memberships.values():
+        for user_id in members:
+            counts[user_id] = counts.get(user_id, 0) + 1
+    busiest_user = max(counts, key=counts.get)
+
+    return {'user_ids': user_ids, 'group_ids': group_ids, 'busiest_user': busiest_user}
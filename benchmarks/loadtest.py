@@ -0,0 +1,282 @@
+"""Drive a mix of user traffic at a local server and report latency per endpoint.
+
+Usage:
+    python -m benchmarks.loadtest [--sessions 100] [--duration 30]
+        [--mix login=1,dashboard=4,group_detail=4,add_expense=2,mark_settled=1]
+        [--set SQLITE_PRAGMAS='{"journal_mode": "wal"}' ...] [--output results.json]
+
+Seeds a database with ``benchmarks.datagen``, starts the app on a threaded
+local server and runs ``--sessions`` logged-in clients, each picking its next
+request from ``--mix`` by weight. Requests made during ``--warmup`` are not
+counted. ``--set`` overrides a config value for the run (the value is parsed
+as JSON when it can be), so two server configurations can be compared on the
+same workload.
+
+Lock timeouts are counted on the server side, as database errors whose
+message says the database is locked, since clients only ever see a 500.
+Clients and server share one process, so absolute numbers understate what
+a real deployment manages; compare runs with each other.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from benchmarks import load_app
+from benchmarks.bench_login_storm import percentile, post_login
+from benchmarks.datagen import Scale, populate
+from benchmarks.run import git_revision
+
+ENDPOINTS = ('login', 'dashboard', 'group_detail', 'add_expense', 'mark_settled')
+DEFAULT_MIX = 'login=1,dashboard=4,group_detail=4,add_expense=2,mark_settled=1'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f'unknown endpoint {name!r}, expected one of {", ".join(ENDPOINTS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_setting(value):
+    name, _, raw = value.partition('=')
+    try:
+        return name, json.loads(raw)
+    except ValueError:
+        return name, raw
+
+
+class Session:
+    """One simulated user: a cookie jar plus the groups they belong to"""
+
+    def __init__(self, base_url, user_id, groups, rng):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.groups = groups  # {group_id: [member ids]}
+        self.rng = rng
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    @property
+    def email(self):
+        return f'user{self.user_id}@example.com'
+
+    def log_in(self, attempts=50):
+        """Log in before the run, backing off while the hash queue is full"""
+        for attempt in range(attempts):
+            status = post_login(self.opener, self.base_url, self.email)
+            if status == 200:
+                return
+            time.sleep(min(0.05 * 2 ** attempt, 1))
+        raise RuntimeError(f'Could not log in as {self.email}')
+
+    def request(self, endpoint):
+        """Make one request of the given kind and return ``(status, ok)``"""
+        group_id = self.rng.choice(list(self.groups))
+        members = self.groups[group_id]
+        if endpoint == 'login':
+            status = post_login(self.opener, self.base_url, self.email)
+            return status, status == 200
+        if endpoint == 'dashboard':
+            return self.send('/dashboard')
+        if endpoint == 'group_detail':
+            return self.send(f'/group/{group_id}')
+        if endpoint == 'add_expense':
+            return self.send(f'/add-expense/{group_id}', {
+                'description': f'Load test {self.rng.randrange(10000)}',
+                'amount': round(self.rng.uniform(5, 200), 2),
+                'paid_by': self.user_id,
+                'split_members': self.rng.sample(members, self.rng.randint(1, len(members)))
+            })
+        to_user = self.rng.choice([member for member in members if member != self.user_id] or members)
+        return self.send('/mark-settled', {
+            'group_id': group_id, 'from_user': self.user_id, 'to_user': to_user,
+            'amount': round(self.rng.uniform(1, 50), 2)
+        })
+
+    def send(self, path, payload=None):
+        if payload is None:
+            request = urllib.request.Request(self.base_url + path)
+        else:
+            request = urllib.request.Request(self.base_url + path, method='POST', data=json.dumps(payload).encode(),
+                                             headers={'Content-Type': 'application/json',
+                                                      'Idempotency-Key': uuid.uuid4().hex})
+        try:
+            with self.opener.open(request) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            return e.code, False
+        if payload is not None:
+            return status, json.loads(body).get('success', False)
+        return status, True
+
+
+def session_loop(session, mix, think_time, stop, recording, samples):
+    endpoints, weights = list(mix), list(mix.values())
+    while not stop.is_set():
+        endpoint = session.rng.choices(endpoints, weights)[0]
+        started = time.perf_counter()
+        try:
+            status, ok = session.request(endpoint)
+        except OSError:
+            status, ok = 'connection', False
+        elapsed = (time.perf_counter() - started) * 1000
+        if recording.is_set():
+            samples.append((endpoint, elapsed, status, ok))
+        if think_time:
+            time.sleep(session.rng.expovariate(1000 / think_time))
+
+
+def summarize(samples, seconds):
+    latencies = [elapsed for _, elapsed, _, _ in samples]
+    statuses = {}
+    for _, _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(not ok for _, _, _, ok in samples)
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / seconds, 1),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'statuses': dict(sorted(statuses.items()))
+    }
+
+
+def count_lock_errors(engine, counter):
+    """Count statements that failed because SQLite's write lock could not be taken in time"""
+    lock = threading.Lock()
+
+    @event.listens_for(engine, 'handle_error')
+    def on_error(context):
+        if 'database is locked' in str(context.original_exception):
+            with lock:
+                counter['locked'] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100, help='Concurrent logged-in clients.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to measure for.')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds to run before measuring.')
+    parser.add_argument('--think-time', type=float, default=0,
+                        help='Mean pause between a session\'s requests, in ms.')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f'Endpoint weights (default {DEFAULT_MIX}).')
+    parser.add_argument('--set', dest='settings', type=parse_setting, action='append', default=[],
+                        metavar='NAME=VALUE', help='Override an app config value.')
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--members-per-group', type=int, default=8)
+    parser.add_argument('--expenses-per-group', type=int, default=500)
+    parser.add_argument('--groups-per-user', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+
+    scale = Scale(groups=args.groups, members_per_group=args.members_per_group,
+                  expenses_per_group=args.expenses_per_group, settlements_per_group=20,
+                  groups_per_user=args.groups_per_user)
+    settings = dict(args.settings)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        splitly, app = load_app(f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                                REPORT_CACHE_DIR=os.path.join(tmp, 'reports'), **settings)
+        lock_errors = {'locked': 0}
+        with app.app_context():
+            populate(splitly, scale, seed=args.seed)
+            groups_by_user = {}
+            members_by_group = {}
+            for group_id, user_id in splitly.db.session.query(splitly.GroupMember.group_id,
+                                                              splitly.GroupMember.user_id):
+                groups_by_user.setdefault(user_id, []).append(group_id)
+                members_by_group.setdefault(group_id, []).append(user_id)
+            count_lock_errors(splitly.db.engine, lock_errors)
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        try:
+            user_ids = sorted(groups_by_user)
+            sessions = []
+            for index in range(args.sessions):
+                user_id = user_ids[index % len(user_ids)]
+                session = Session(base_url, user_id,
+                                  {group_id: members_by_group[group_id] for group_id in groups_by_user[user_id]},
+                                  random.Random(args.seed + index))
+                session.log_in()
+                sessions.append(session)
+
+            stop, recording = threading.Event(), threading.Event()
+            samples = []
+            threads = [threading.Thread(target=session_loop,
+                                        args=(session, args.mix, args.think_time, stop, recording, samples))
+                       for session in sessions]
+            for thread in threads:
+                thread.start()
+            time.sleep(args.warmup)
+            locked_before = lock_errors['locked']
+            recording.set()
+            started = time.perf_counter()
+            time.sleep(args.duration)
+            recording.clear()
+            elapsed = time.perf_counter() - started
+            locked = lock_errors['locked'] - locked_before
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            server.shutdown()
+
+    endpoints = {name: summarize([sample for sample in samples if sample[0] == name], elapsed)
+                 for name in args.mix}
+    overall = summarize(samples, elapsed)
+    overall['lock_timeouts'] = locked
+    overall['lock_timeout_rate'] = round(locked / len(samples), 4) if samples else 0
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'scale': scale.to_dict(),
+            'sessions': args.sessions,
+            'duration': round(elapsed, 2),
+            'warmup': args.warmup,
+            'think_time_ms': args.think_time,
+            'mix': args.mix,
+            'settings': settings
+        },
+        'overall': overall,
+        'endpoints': endpoints
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    print(f'{"endpoint":<14} {"requests":>9} {"rps":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for name, result in list(endpoints.items()) + [('overall', overall)]:
+        print(f'{name:<14} {result["requests"]:>9} {result["throughput_rps"]:>7} {result["p50_ms"]!s:>8} '
+              f'{result["p95_ms"]!s:>8} {result["p99_ms"]!s:>8} {result["errors"]:>7}')
+    print(f'lock timeouts: {locked} ({overall["lock_timeout_rate"]:.2%} of requests)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Run the Splitly benchmark suite and write the results as JSON.
+
+Usage:
+    python -m benchmarks.run [--expenses-per-group 2000 ...] [--output results.json]
+    python -m benchmarks.run --compare baseline.json [--threshold 0.25]
+
+With ``--compare`` the process exits with status 1 if any benchmark's median
+is more than ``threshold`` (a fraction) slower than in the baseline file.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import ROOT, load_app
+from benchmarks.datagen import PASSWORD, Scale, populate
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'runs': repeat,
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+
+def run_suite(splitly, app, seeded, repeat, pdf_repeat):
+    group_id = seeded['group_ids'][0]
+    results = {}
+
+    with app.app_context():
+        results['calculate_group_balances'] = measure(
+            lambda: splitly.calculate_group_balances(group_id), repeat)
+        results['replay_group_balances'] = measure(
+            lambda: splitly.replay_group_balances(group_id), max(1, repeat // 5))
+        balances = splitly.calculate_group_balances(group_id)
+        results['calculate_settlements'] = measure(
+            lambda: splitly.calculate_settlements(balances), repeat)
+        results['get_user_positions'] = measure(
+            lambda: splitly.get_user_positions(seeded['busiest_user']), repeat)
+        results['search_expenses'] = measure(
+            lambda: splitly.search_expenses(group_id, 'dinner'), repeat)
+        payer = splitly.db.session.query(splitly.Expense.paid_by).filter(
+            splitly.Expense.group_id == group_id).limit(1).scalar()
+        results['search_expenses_filtered'] = measure(
+            lambda: splitly.search_expenses(group_id, 'bill', payer=payer, since=datetime(2020, 1, 15)), repeat)
+
+        def build_pdf():
+            with tempfile.TemporaryFile() as output:
+                splitly.build_group_report(group_id, output)
+
+        results['build_group_report'] = measure(build_pdf, pdf_repeat)
+
+    client = app.test_client()
+    user_email = f'user{seeded["busiest_user"]}@example.com'
+    response = client.post('/login', json={'email': user_email, 'password': PASSWORD})
+    if not response.get_json().get('success'):
+        raise RuntimeError(f'Could not log in as {user_email}')
+
+    views = {
+        'view_dashboard': '/dashboard',
+        'view_group_detail': f'/group/{group_id}',
+        'view_settle_up': f'/settle-up/{group_id}',
+    }
+    with app.app_context():
+        member_of = {group_id for (group_id,) in splitly.db.session.query(splitly.GroupMember.group_id).filter(
+            splitly.GroupMember.user_id == seeded['busiest_user'])}
+    if group_id not in member_of:
+        views['view_group_detail'] = f'/group/{min(member_of)}'
+        views['view_settle_up'] = f'/settle-up/{min(member_of)}'
+
+    for name, url in views.items():
+        def get(url=url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} returned {response.status_code}')
+        results[name] = measure(get, repeat)
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print a comparison table and return the names of regressed benchmarks"""
+    regressions = []
+    print(f'{"benchmark":<28} {"baseline ms":>12} {"current ms":>11} {"change":>8}')
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'{name:<28} {"-":>12} {result["median_ms"]:>11.2f} {"new":>8}')
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0
+        flag = ' REGRESSION' if change > threshold else ''
+        print(f'{name:<28} {before["median_ms"]:>12.2f} {result["median_ms"]:>11.2f} {change:>+8.1%}{flag}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    defaults = Scale()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, default=defaults.groups)
+    parser.add_argument('--members-per-group', type=int, default=defaults.members_per_group)
+    parser.add_argument('--expenses-per-group', type=int, default=defaults.expenses_per_group)
+    parser.add_argument('--settlements-per-group', type=int, default=defaults.settlements_per_group)
+    parser.add_argument('--groups-per-user', type=int, default=defaults.groups_per_user)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per benchmark.')
+    parser.add_argument('--pdf-repeat', type=int, default=3, help='Timed runs for the PDF benchmark.')
+    parser.add_argument('--output', help='Write JSON results to this file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against an earlier JSON result.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown before --compare fails, as a fraction.')
+    args = parser.parse_args()
+
+    scale = Scale(groups=args.groups, members_per_group=args.members_per_group,
+                  expenses_per_group=args.expenses_per_group,
+                  settlements_per_group=args.settlements_per_group,
+                  groups_per_user=args.groups_per_user)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        splitly, app = load_app(f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                                REPORT_CACHE_DIR=os.path.join(tmp, 'reports'))
+
+        started = time.perf_counter()
+        with app.app_context():
+            seeded = populate(splitly, scale, seed=args.seed)
+        seed_seconds = time.perf_counter() - started
+
+        results = run_suite(splitly, app, seeded, args.repeat, args.pdf_repeat)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'scale': scale.to_dict(),
+            'seed_seconds': round(seed_seconds, 2)
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('scale') != report['meta']['scale']:
+            print('warning: baseline was recorded at a different scale', file=sys.stderr)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}')
+            sys.exit(1)
+    else:
+        print(f'{"benchmark":<28} {"median ms":>10} {"p95 ms":>9}')
+        for name, result in sorted(results.items()):
+            print(f'{name:<28} {result["median_ms"]:>10.2f} {result["p95_ms"]:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
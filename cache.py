@@ -0,0 +1,123 @@
+"""Small in-process caches, plus a two-tier cache that can share entries between processes."""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after ``ttl`` seconds.
+
+    Each process has its own copy, so writers must call :meth:`invalidate`
+    for keys they change; ``ttl`` bounds how stale other processes can get.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DatabaseCache:
+    """String values in a table every process can read, for use as a shared tier.
+
+    ``table`` needs ``key`` (primary key), ``value`` and ``expires_at``
+    (epoch seconds) columns. Expired rows are pruned every ``prune_every``
+    writes.
+    """
+
+    def __init__(self, engine, table, ttl=600, prune_every=100):
+        self.engine = engine
+        self.table = table
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._writes = 0
+
+    def get(self, key):
+        table = self.table
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(table.c.value).where(table.c.key == key, table.c.expires_at > time.time())
+            ).scalar()
+
+    def set(self, key, value):
+        table = self.table
+        expires_at = time.time() + self.ttl
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                update(table).where(table.c.key == key).values(value=value, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(table).values(key=key, value=value, expires_at=expires_at))
+                except IntegrityError:
+                    pass  # another process stored it first
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                conn.execute(delete(table).where(table.c.expires_at <= time.time()))
+
+
+class TieredCache:
+    """A :class:`TTLCache` in front of an optional shared cache.
+
+    ``shared`` can be any object with ``get(key)`` returning None on a miss
+    and ``set(key, value)``: a :class:`DatabaseCache`, or a thin wrapper
+    around Redis or memcached. Shared hits are copied into the local tier.
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def lookup(self, key):
+        """Return ``(value, tier)``, where tier is 'local', 'shared' or None on a miss"""
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value, 'local'
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+                return value, 'shared'
+        return None, None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
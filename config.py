@@ -4,3 +4,85 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///splitly.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool, ignored for in-memory SQLite
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+
+    # Applied to every new SQLite connection. WAL lets readers run alongside
+    # a writer, and busy_timeout makes writers wait instead of failing with
+    # "database is locked".
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'cache_size': -64000,  # negative means KiB, so 64 MB
+        'mmap_size': 256 * 1024 * 1024,
+    }
+
+    # Full Werkzeug method string; stored hashes made with anything else are
+    # rehashed on the user's next successful login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 32))
+
+    # Per-process caches of session users and group memberships
+    AUTH_CACHE_SIZE = 4096
+    AUTH_CACHE_TTL = 60
+
+    EXPENSE_PAGE_SIZE = 30
+    API_MAX_BATCH = 100
+
+    METRICS_ENABLED = True
+    SLOW_QUERY_MS = None  # set to e.g. 100 to log queries slower than that
+    N_PLUS_ONE_THRESHOLD = 10
+
+    # Live updates on group pages. Each open stream holds a server thread for
+    # as long as the page stays open, so only turn this on under a threaded
+    # or async server (e.g. gunicorn --threads 32 or -k gevent); with a single
+    # sync worker one open tab would block every other request. Beyond
+    # EVENT_MAX_STREAMS open streams per process, new ones are turned away.
+    EVENT_STREAMS_ENABLED = os.environ.get('EVENT_STREAMS_ENABLED', '0') == '1'
+    EVENT_MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', 32))
+    # 'local' serves one process; 'database' relays events through the
+    # group_event table so every worker process sees them
+    EVENT_BACKEND = os.environ.get('EVENT_BACKEND', 'local')
+    EVENT_QUEUE_SIZE = 100  # per connection; a full queue turns into a resync
+    EVENT_KEEPALIVE = 15
+    EVENT_POLL_INTERVAL = 0.5
+    EVENT_RETENTION = 300
+
+    # Rendered page fragments, keyed by group id and version. 'database' adds
+    # the fragment_cache table as a tier shared by every worker process.
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'local')
+    FRAGMENT_CACHE_SIZE = 512
+    FRAGMENT_CACHE_TTL = 600
+
+    # Group commit for add_expense and mark_settled: writes arriving within
+    # this many ms share one transaction. 0 commits each request on its own.
+    WRITE_COALESCE_MS = float(os.environ.get('WRITE_COALESCE_MS', 0))
+    WRITE_COALESCE_MAX_BATCH = 64
+    WRITE_QUEUE_SIZE = 256
+    IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+    EXPORT_BATCH_SIZE = 1000
+    IMPORT_BATCH_SIZE = 2000
+
+    # History older than this is checkpointed and may be moved to the archive tables
+    CHECKPOINT_MIN_AGE_DAYS = 90
+    ARCHIVE_BATCH_SIZE = 1000
+
+    SETTLEMENT_STRATEGY = 'optimal'  # or 'greedy'
+    SETTLEMENT_EXACT_LIMIT = 14
+    SETTLEMENT_TIME_BUDGET = 0.05
+
+    REPORT_WORKERS = 2
+    REPORT_QUEUE_SIZE = 16
+    REPORT_CHUNK_SIZE = 500
+    REPORT_ROWS_PER_TABLE = 40
+    REPORT_CACHE_DIR = None  # defaults to <instance>/reports
+    REPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+    REPORT_CACHE_MAX_AGE = 7 * 24 * 3600
@@ -0,0 +1,164 @@
+"""Publish/subscribe for live group updates, streamed to browsers as SSE.
+
+Each process has one :class:`Broker` holding its open subscriptions. Events
+reach the broker through a backend: :class:`LocalBackend` delivers straight
+to it, which is enough for a single process, while :class:`DatabaseBackend`
+writes events to a table that every process polls, so subscribers attached
+to other workers hear about them too.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import delete, insert, select
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One listener's bounded event queue.
+
+    When a slow consumer lets the queue fill up, its backlog is dropped and
+    replaced by a single ``resync`` event telling the client to reload.
+    """
+
+    def __init__(self, channel, max_queue=100):
+        self.channel = channel
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+
+    def put(self, event):
+        with self._lock:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self._drain()
+                self._queue.put_nowait({'type': 'resync'})
+
+    def get(self, timeout=None):
+        """Return the next event, or None if none arrived within ``timeout``"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class Broker:
+    """Fans events out to the subscriptions open in this process"""
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self.max_queue)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def deliver(self, channel, event):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._channels.values())
+
+
+class LocalBackend:
+    """Deliver events to subscribers in this process only"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, channel, events):
+        for event in events:
+            self.broker.deliver(channel, event)
+
+    def start(self):
+        pass
+
+
+class DatabaseBackend:
+    """Relay events through a table that every process polls.
+
+    ``table`` needs ``id`` (autoincrementing), ``channel``, ``payload`` and
+    ``created_at`` columns. Rows older than ``retention`` seconds are pruned
+    by the pollers.
+    """
+
+    def __init__(self, broker, engine, table, interval=0.5, retention=300):
+        self.broker = broker
+        self.engine = engine
+        self.table = table
+        self.interval = interval
+        self.retention = retention
+        self._thread = None
+        self._stop = threading.Event()
+        self._last_id = None
+
+    def publish(self, channel, events):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(insert(self.table), [
+                {'channel': channel, 'payload': json.dumps(event, separators=(',', ':')), 'created_at': now}
+                for event in events
+            ])
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._poll_forever, name='event-poller', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _poll_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Event poll failed')
+
+    def poll(self):
+        """Deliver rows written since the last poll and prune old ones"""
+        table = self.table
+        with self.engine.begin() as conn:
+            if self._last_id is None:
+                # Start from the current end of the log; older events are history
+                self._last_id = conn.execute(select(table.c.id).order_by(table.c.id.desc()).limit(1)).scalar() or 0
+                return
+            rows = conn.execute(
+                select(table.c.id, table.c.channel, table.c.payload)
+                .where(table.c.id > self._last_id).order_by(table.c.id)
+            ).all()
+            conn.execute(delete(table).where(table.c.created_at < time.time() - self.retention))
+
+        for row in rows:
+            self._last_id = row.id
+            self.broker.deliver(row.channel, json.loads(row.payload))
+
+
+def format_sse(event):
+    """Render an event dict as one SSE message"""
+    return f'event: {event["type"]}\ndata: {json.dumps(event, separators=(",", ":"))}\n\n'
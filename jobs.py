@@ -0,0 +1,178 @@
+"""Background job queue and on-disk artifact cache used for PDF reports."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class Job:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, key, owner=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.owner = owner
+        self.status = Job.PENDING
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (Job.DONE, Job.FAILED)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobQueue:
+    """Run jobs on a fixed-size thread pool with a cap on queued work.
+
+    Submitting a job whose key is already pending or running returns the
+    existing job instead of queueing the same work twice.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, history=256):
+        self.max_pending = max_pending
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active = {}
+
+    def submit(self, key, fn, *args, owner=None, **kwargs):
+        with self._lock:
+            active = self._active.get(key)
+            if active is not None:
+                return active
+            if len(self._active) >= self.max_pending:
+                raise QueueFull(f'{len(self._active)} jobs already queued')
+
+            job = Job(key, owner=owner)
+            self._active[key] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.finished:
+                    break
+                del self._jobs[oldest_id]
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = Job.RUNNING
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = Job.DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = Job.FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active.pop(job.key, None)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class ArtifactCache:
+    """Files stored under a directory by key, evicted by age and total size.
+
+    Entries are written to a temporary file first and renamed into place so
+    readers never see a partially written artifact.
+    """
+
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the path of a cached artifact, or None if missing or expired"""
+        path = self.path_for(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return None
+        if self.max_age and age > self.max_age:
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except OSError:
+            return None
+        return path
+
+    def temp_path(self):
+        """Reserve a temporary file in the cache directory for a new artifact"""
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        return path
+
+    def put(self, key, source_path):
+        """Move a finished file into the cache and return its cached path"""
+        path = self.path_for(key)
+        shutil.move(source_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Drop expired artifacts, then least recently used ones until under max_bytes"""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if self.max_age and now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((stat.st_atime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
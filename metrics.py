@@ -0,0 +1,173 @@
+"""In-process metrics: histograms and counters rendered as Prometheus text,
+plus per-request timing that feeds the ``Server-Timing`` header."""
+import threading
+import time
+from contextlib import ContextDecorator
+
+from flask import g, has_request_context
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, label_values, ('le', bound))
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                labels = _format_labels(self.labels, label_values, ('le', '+Inf'))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'splitly_request_duration_seconds', 'Request latency by endpoint.',
+    labels=('endpoint', 'method', 'status')))
+request_queries = registry.register(Histogram(
+    'splitly_request_db_queries', 'Database queries issued per request.',
+    labels=('endpoint',), buckets=COUNT_BUCKETS))
+request_db_time = registry.register(Histogram(
+    'splitly_request_db_seconds', 'Time spent in the database per request.',
+    labels=('endpoint',)))
+section_duration = registry.register(Histogram(
+    'splitly_section_seconds', 'Time spent in instrumented code sections.',
+    labels=('section',)))
+slow_queries = registry.register(Counter(
+    'splitly_slow_queries_total', 'Queries slower than the slow query threshold.',
+    labels=('endpoint',)))
+repeated_queries = registry.register(Counter(
+    'splitly_repeated_query_requests_total', 'Requests that repeated one statement past the N+1 threshold.',
+    labels=('endpoint',)))
+password_hash_rejections = registry.register(Counter(
+    'splitly_password_hash_rejections_total', 'Password hashing calls refused because the pool was full.',
+    labels=('operation',)))
+write_batch_size = registry.register(Histogram(
+    'splitly_write_batch_size', 'Writes committed together per group-commit transaction.',
+    buckets=COUNT_BUCKETS))
+fragment_cache_lookups = registry.register(Counter(
+    'splitly_fragment_cache_lookups_total', 'Rendered fragment lookups by the tier that answered, or miss.',
+    labels=('fragment', 'result')))
+
+
+def start_request():
+    g.metrics = {'started': time.perf_counter(), 'queries': 0, 'db_time': 0.0,
+                 'statements': {}, 'sections': {}}
+
+
+def request_metrics():
+    return g.get('metrics') if has_request_context() else None
+
+
+def record_query(statement, duration):
+    metrics = request_metrics()
+    if metrics is None:
+        return
+    metrics['queries'] += 1
+    metrics['db_time'] += duration
+    metrics['statements'][statement] = metrics['statements'].get(statement, 0) + 1
+
+
+class timed(ContextDecorator):
+    """Time a block or function as a named section.
+
+    Usable as ``with timed('balances'):`` or ``@timed('balances')``. The time
+    goes into the section histogram and, inside a request, the
+    ``Server-Timing`` header.
+    """
+
+    def __init__(self, section):
+        self.section = section
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._started
+        section_duration.observe(elapsed, self.section)
+        metrics = request_metrics()
+        if metrics is not None:
+            metrics['sections'][self.section] = metrics['sections'].get(self.section, 0.0) + elapsed
+        return False
+
+
+def server_timing(metrics, total):
+    """Build a Server-Timing header value from one request's metrics"""
+    parts = [f'app;dur={total * 1000:.1f}',
+             f'db;dur={metrics["db_time"] * 1000:.1f};desc="{metrics["queries"]} queries"']
+    for section, elapsed in metrics['sections'].items():
+        parts.append(f'{section};dur={elapsed * 1000:.1f}')
+    return ', '.join(parts)
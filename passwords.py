@@ -0,0 +1,53 @@
+"""Password hashing on a dedicated, bounded thread pool.
+
+Hashing is deliberately slow. Running it on the request threads lets a burst
+of logins occupy every worker, so hashes are computed on a small pool of
+their own instead, and callers are turned away once that pool's queue is full.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from jobs import QueueFull
+
+
+class PasswordHasher:
+    """Hash and verify passwords on at most ``max_workers`` threads.
+
+    Up to ``max_pending`` further calls may wait for a free worker; beyond
+    that :class:`jobs.QueueFull` is raised straight away. ``method`` is a
+    full Werkzeug method string such as ``pbkdf2:sha256:600000`` or
+    ``scrypt:32768:8:1``, spelled out so stored hashes can be compared
+    against it.
+    """
+
+    def __init__(self, method='pbkdf2:sha256:600000', salt_length=16, max_workers=2, max_pending=32):
+        self.method = method
+        self.salt_length = salt_length
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hash')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def _call(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull('Password hashing queue is full')
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        return self._call(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if ``password_hash`` was made with different parameters than ours"""
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
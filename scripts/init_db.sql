@@ -17,6 +17,10 @@ CREATE TABLE IF NOT EXISTS group (
     code VARCHAR(6) UNIQUE NOT NULL,
     created_by INTEGER NOT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at DATETIME,
+    expense_count INTEGER NOT NULL DEFAULT 0,
+    total_spent REAL NOT NULL DEFAULT 0,
     FOREIGN KEY (created_by) REFERENCES user (id)
 );
 
@@ -44,6 +48,16 @@ CREATE TABLE IF NOT EXISTS expense (
     FOREIGN KEY (paid_by) REFERENCES user (id)
 );
 
+-- Expense shares table (one row per member an expense is split with)
+CREATE TABLE IF NOT EXISTS expense_share (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    expense_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    share_amount REAL NOT NULL,
+    FOREIGN KEY (expense_id) REFERENCES expense (id),
+    FOREIGN KEY (user_id) REFERENCES user (id)
+);
+
 -- Settlements table
 CREATE TABLE IF NOT EXISTS settlement (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -57,8 +71,157 @@ CREATE TABLE IF NOT EXISTS settlement (
     FOREIGN KEY (to_user) REFERENCES user (id)
 );
 
+-- Member balances table (materialized ledger, one row per group member)
+CREATE TABLE IF NOT EXISTS member_balance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    balance REAL NOT NULL DEFAULT 0,
+    FOREIGN KEY (group_id) REFERENCES group (id),
+    FOREIGN KEY (user_id) REFERENCES user (id),
+    UNIQUE(group_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS pairwise_balance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    counterparty_id INTEGER NOT NULL,
+    amount REAL NOT NULL DEFAULT 0,
+    FOREIGN KEY (group_id) REFERENCES group (id),
+    FOREIGN KEY (user_id) REFERENCES user (id),
+    FOREIGN KEY (counterparty_id) REFERENCES user (id),
+    UNIQUE(group_id, user_id, counterparty_id)
+);
+
+-- Monthly analytics rollups (one row per group, member and month)
+CREATE TABLE IF NOT EXISTS monthly_rollup (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    month VARCHAR(7) NOT NULL,
+    paid REAL NOT NULL DEFAULT 0,
+    owed REAL NOT NULL DEFAULT 0,
+    settled_out REAL NOT NULL DEFAULT 0,
+    settled_in REAL NOT NULL DEFAULT 0,
+    expense_count INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (group_id) REFERENCES group (id),
+    FOREIGN KEY (user_id) REFERENCES user (id),
+    UNIQUE(group_id, month, user_id)
+);
+
+-- Balance checkpoints: member balances as of an expense and a settlement id
+CREATE TABLE IF NOT EXISTS balance_checkpoint (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL,
+    expense_id INTEGER NOT NULL DEFAULT 0,
+    settlement_id INTEGER NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    archived_at DATETIME,
+    FOREIGN KEY (group_id) REFERENCES group (id)
+);
+
+CREATE TABLE IF NOT EXISTS checkpoint_balance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    checkpoint_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    balance REAL NOT NULL,
+    FOREIGN KEY (checkpoint_id) REFERENCES balance_checkpoint (id),
+    FOREIGN KEY (user_id) REFERENCES user (id)
+);
+
+-- Archive tables: checkpointed history moved out of expense, expense_share and settlement
+CREATE TABLE IF NOT EXISTS archived_expense (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL,
+    description VARCHAR(200) NOT NULL,
+    amount REAL NOT NULL,
+    paid_by INTEGER NOT NULL,
+    split_members TEXT NOT NULL,
+    date DATETIME,
+    FOREIGN KEY (group_id) REFERENCES group (id),
+    FOREIGN KEY (paid_by) REFERENCES user (id)
+);
+
+CREATE TABLE IF NOT EXISTS archived_expense_share (
+    id INTEGER PRIMARY KEY,
+    expense_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    share_amount REAL NOT NULL,
+    FOREIGN KEY (expense_id) REFERENCES archived_expense (id),
+    FOREIGN KEY (user_id) REFERENCES user (id)
+);
+
+CREATE TABLE IF NOT EXISTS archived_settlement (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL,
+    from_user INTEGER NOT NULL,
+    to_user INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    date DATETIME,
+    FOREIGN KEY (group_id) REFERENCES group (id),
+    FOREIGN KEY (from_user) REFERENCES user (id),
+    FOREIGN KEY (to_user) REFERENCES user (id)
+);
+
+-- First response to each client Idempotency-Key, replayed on retries
+CREATE TABLE IF NOT EXISTS idempotency_key (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    key VARCHAR(64) NOT NULL,
+    endpoint VARCHAR(64) NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL,
+    response TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES user (id),
+    UNIQUE(user_id, key)
+);
+
+-- Outbox for live group events relayed between processes
+CREATE TABLE IF NOT EXISTS group_event (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel VARCHAR(64) NOT NULL,
+    payload TEXT NOT NULL,
+    created_at FLOAT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS fragment_cache (
+    key VARCHAR(128) PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at FLOAT NOT NULL
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_group_member_group_id ON group_member(group_id);
 CREATE INDEX IF NOT EXISTS idx_group_member_user_id ON group_member(user_id);
+CREATE INDEX IF NOT EXISTS ix_group_member_group_user ON group_member(group_id, user_id);
+CREATE INDEX IF NOT EXISTS ix_group_member_user_group ON group_member(user_id, group_id);
 CREATE INDEX IF NOT EXISTS idx_expense_group_id ON expense(group_id);
+CREATE INDEX IF NOT EXISTS ix_expense_group_date_id ON expense(group_id, date, id);
 CREATE INDEX IF NOT EXISTS idx_settlement_group_id ON settlement(group_id);
+CREATE INDEX IF NOT EXISTS ix_settlement_group_date ON settlement(group_id, date);
+CREATE INDEX IF NOT EXISTS ix_expense_share_expense_id ON expense_share(expense_id);
+CREATE INDEX IF NOT EXISTS ix_expense_share_user_expense ON expense_share(user_id, expense_id);
+CREATE INDEX IF NOT EXISTS ix_group_event_created_at ON group_event(created_at);
+CREATE INDEX IF NOT EXISTS ix_fragment_cache_expires_at ON fragment_cache(expires_at);
+CREATE INDEX IF NOT EXISTS ix_monthly_rollup_user_month ON monthly_rollup(user_id, month);
+CREATE INDEX IF NOT EXISTS ix_pairwise_balance_user ON pairwise_balance(user_id, counterparty_id, group_id, amount);
+CREATE INDEX IF NOT EXISTS ix_idempotency_key_created_at ON idempotency_key(created_at);
+CREATE INDEX IF NOT EXISTS ix_balance_checkpoint_group_id ON balance_checkpoint(group_id, id);
+CREATE INDEX IF NOT EXISTS ix_checkpoint_balance_checkpoint_id ON checkpoint_balance(checkpoint_id);
+CREATE INDEX IF NOT EXISTS ix_archived_expense_group_date_id ON archived_expense(group_id, date, id);
+CREATE INDEX IF NOT EXISTS ix_archived_expense_share_expense_id ON archived_expense_share(expense_id);
+CREATE INDEX IF NOT EXISTS ix_archived_settlement_group_date ON archived_settlement(group_id, date);
+
+-- Full-text index over expense descriptions, kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS expense_fts USING fts5(description, content='expense', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS expense_fts_insert AFTER INSERT ON expense BEGIN
+    INSERT INTO expense_fts(rowid, description) VALUES (new.id, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS expense_fts_delete AFTER DELETE ON expense BEGIN
+    INSERT INTO expense_fts(expense_fts, rowid, description) VALUES ('delete', old.id, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS expense_fts_update AFTER UPDATE OF description ON expense BEGIN
+    INSERT INTO expense_fts(expense_fts, rowid, description) VALUES ('delete', old.id, old.description);
+    INSERT INTO expense_fts(rowid, description) VALUES (new.id, new.description);
+END;
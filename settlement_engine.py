@@ -0,0 +1,179 @@
+"""Settlement planning in integer cents.
+
+Turning a set of balances into transfers needs at most ``n - 1`` payments,
+and every subgroup of members whose balances already sum to zero can settle
+among itself, saving one payment. Minimizing the number of transfers is
+therefore the same as splitting the members into as many zero-sum subgroups
+as possible. That is solved exactly for small groups and approximated within
+a time budget for large ones.
+"""
+import time
+from collections import defaultdict
+
+STRATEGIES = ('optimal', 'greedy')
+
+
+def to_cents(balances):
+    """Convert float balances to integer cents that sum to exactly zero.
+
+    Rounding leftovers are absorbed by the largest balance so no dust is left.
+    """
+    cents = {user_id: int(round(amount * 100)) for user_id, amount in balances.items()}
+    residual = sum(cents.values())
+    if residual and cents:
+        largest = max(cents, key=lambda user_id: abs(cents[user_id]))
+        cents[largest] -= residual
+    return {user_id: amount for user_id, amount in cents.items() if amount}
+
+
+def greedy_transfers(cents):
+    """Match the largest debtor with the largest creditor until everyone is even"""
+    creditors = sorted(((amount, user_id) for user_id, amount in cents.items() if amount > 0), reverse=True)
+    debtors = sorted(((-amount, user_id) for user_id, amount in cents.items() if amount < 0), reverse=True)
+
+    transfers = []
+    i, j = 0, 0
+    while i < len(creditors) and j < len(debtors):
+        credit, creditor_id = creditors[i]
+        debt, debtor_id = debtors[j]
+        amount = min(credit, debt)
+        transfers.append((debtor_id, creditor_id, amount))
+
+        creditors[i] = (credit - amount, creditor_id)
+        debtors[j] = (debt - amount, debtor_id)
+        if creditors[i][0] == 0:
+            i += 1
+        if debtors[j][0] == 0:
+            j += 1
+    return transfers
+
+
+def _pop_matching_pairs(cents):
+    """Split off every (x, -x) pair; pairing them is always part of an optimal plan"""
+    by_amount = defaultdict(list)
+    for user_id, amount in cents.items():
+        by_amount[amount].append(user_id)
+
+    groups = []
+    for amount in list(by_amount):
+        if amount <= 0:
+            continue
+        positives, negatives = by_amount[amount], by_amount.get(-amount, [])
+        while positives and negatives:
+            groups.append([positives.pop(), negatives.pop()])
+
+    paired = {user_id for group in groups for user_id in group}
+    rest = {user_id: amount for user_id, amount in cents.items() if user_id not in paired}
+    return groups, rest
+
+
+def _pop_matching_triples(cents, deadline):
+    """Greedily split off zero-sum triples until none are left or time runs out"""
+    rest = dict(cents)
+    groups = []
+    by_amount = defaultdict(set)
+    for user_id, amount in rest.items():
+        by_amount[amount].add(user_id)
+
+    found = True
+    while found and time.perf_counter() < deadline:
+        found = False
+        members = sorted(rest, key=rest.get)
+        for index, first in enumerate(members):
+            if time.perf_counter() >= deadline:
+                break
+            for second in members[index + 1:]:
+                if first not in rest or second not in rest:
+                    continue
+                wanted = -(rest[first] + rest[second])
+                third = next((user_id for user_id in by_amount.get(wanted, ())
+                              if user_id not in (first, second)), None)
+                if third is None:
+                    continue
+                group = [first, second, third]
+                for user_id in group:
+                    by_amount[rest.pop(user_id)].discard(user_id)
+                groups.append(group)
+                found = True
+                break
+    return groups, rest
+
+
+def _max_zero_sum_partition(cents):
+    """Partition members into the largest possible number of zero-sum groups.
+
+    Dynamic programming over subsets, so only usable for small ``n``.
+    """
+    members = list(cents)
+    amounts = [cents[user_id] for user_id in members]
+    n = len(members)
+    full = (1 << n) - 1
+
+    subset_sum = [0] * (1 << n)
+    best = [0] * (1 << n)
+    parent = [0] * (1 << n)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low] + amounts[low.bit_length() - 1]
+        bonus = 1 if subset_sum[mask] == 0 else 0
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            candidate = best[mask ^ bit] + bonus
+            if candidate > best[mask] or parent[mask] == 0:
+                best[mask] = candidate
+                parent[mask] = bit
+
+    # Walk back from the full set; each time the running sum hits zero a group closes
+    groups, current = [], []
+    mask = full
+    while mask:
+        bit = parent[mask]
+        current.append(members[bit.bit_length() - 1])
+        mask ^= bit
+        if subset_sum[mask] == 0:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def optimal_transfers(cents, exact_limit=14, time_budget=0.05):
+    """Plan transfers minimizing their count.
+
+    Exact when what's left after removing matching pairs has at most
+    ``exact_limit`` members; otherwise zero-sum triples are split off for up
+    to ``time_budget`` seconds and the remainder is settled greedily.
+    """
+    deadline = time.perf_counter() + time_budget
+    groups, rest = _pop_matching_pairs(cents)
+
+    if len(rest) > exact_limit:
+        triples, rest = _pop_matching_triples(rest, deadline)
+        groups.extend(triples)
+
+    if len(rest) <= exact_limit:
+        groups.extend(_max_zero_sum_partition(rest))
+    elif rest:
+        groups.append(list(rest))
+
+    transfers = []
+    for group in groups:
+        transfers.extend(greedy_transfers({user_id: cents[user_id] for user_id in group}))
+    return transfers
+
+
+def plan_settlements(balances, strategy='optimal', exact_limit=14, time_budget=0.05):
+    """Return suggested settlements for float balances as a list of dicts"""
+    cents = to_cents(balances)
+    if strategy == 'greedy':
+        transfers = greedy_transfers(cents)
+    elif strategy == 'optimal':
+        transfers = optimal_transfers(cents, exact_limit=exact_limit, time_budget=time_budget)
+    else:
+        raise ValueError(f'Unknown settlement strategy {strategy!r}, expected one of {STRATEGIES}')
+
+    return [{'from_user': from_user, 'to_user': to_user, 'amount': amount / 100}
+            for from_user, to_user, amount in transfers]
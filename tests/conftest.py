@@ -0,0 +1,63 @@
+import pytest
+from flask import g
+
+from app import Group, GroupMember, User, create_app, db
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "test.db"}'
+        # Enforced here so writes that break foreign keys fail like they would on PostgreSQL
+        SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS, foreign_keys='ON')
+        REPORT_CACHE_DIR = str(tmp_path / 'reports')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+    app = create_app(TestConfig)
+
+    # Requests run inside the test's app context, so clear what they keep on g
+    # (the logged-in user, memoized memberships) before the next one
+    @app.teardown_request
+    def forget_request_globals(exc):
+        for name in list(g):
+            g.pop(name)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def group(app):
+    """A group of three members: users 1, 2 and 3"""
+    users = [User(email=f'user{n}@example.com', name=f'User {n}', password_hash='x') for n in (1, 2, 3)]
+    db.session.add_all(users)
+    db.session.flush()
+    group = Group(name='Trip', code='TRIP01', created_by=users[0].id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.add_all(GroupMember(group_id=group.id, user_id=user.id) for user in users)
+    db.session.commit()
+    return group.id
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def add_expense(client, group_id, amount, paid_by, split_members, **headers):
+    response = client.post(f'/add-expense/{group_id}', headers=headers, json={
+        'description': 'Dinner', 'amount': amount, 'paid_by': paid_by, 'split_members': split_members})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['expense_id']
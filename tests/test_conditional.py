@@ -0,0 +1,42 @@
+"""Conditional GETs answered from group versions."""
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from tests.conftest import add_expense, login
+
+
+def test_group_pages_revalidate_by_etag_only(client, group):
+    login(client, 1)
+    first = client.get(f'/group/{group}/expenses')
+    assert first.status_code == 200
+    assert 'Last-Modified' not in first.headers
+    etag = first.headers['ETag']
+
+    assert client.get(f'/group/{group}/expenses', headers={'If-None-Match': etag}).status_code == 304
+
+    # Two writes within a second: a date validator alone must not get a 304
+    add_expense(client, group, 5.0, 1, [1, 2])
+    since = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=1), usegmt=True)
+    assert client.get(f'/group/{group}/expenses', headers={'If-Modified-Since': since}).status_code == 200
+    changed = client.get(f'/group/{group}/expenses', headers={'If-None-Match': etag, 'If-Modified-Since': since})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_json_endpoints_answer_304_until_a_group_changes(client, group):
+    login(client, 1)
+    add_expense(client, group, 9.0, 2, [1, 2, 3])
+    urls = ['/api/v1/positions', '/api/v1/analytics', f'/api/v1/groups/{group}/analytics', '/api/v1/groups']
+    etags = {}
+    for url in urls:
+        response = client.get(url)
+        assert response.status_code == 200
+        etags[url] = response.headers['ETag']
+        assert client.get(url, headers={'If-None-Match': etags[url]}).status_code == 304
+
+    add_expense(client, group, 3.0, 1, [1, 2])
+    for url in urls:
+        response = client.get(url, headers={'If-None-Match': etags[url]})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etags[url]
+    assert client.get('/api/v1/positions').get_json()['net'] == -1.5
@@ -0,0 +1,38 @@
+"""The keyset-paginated expense feed and search."""
+from app import import_expenses
+from tests.conftest import login
+
+
+def walk(client, url, **params):
+    ids, cursor = [], None
+    while True:
+        response = client.get(url, query_string=dict(params, cursor=cursor) if cursor else params)
+        assert response.status_code == 200
+        page = response.get_json()
+        ids.append([expense['id'] for expense in page['expenses']])
+        cursor = page['next_cursor']
+        if not cursor:
+            return ids
+
+
+def test_cursors_walk_every_expense_once_newest_first(client, group):
+    # Shared dates make the id the tie-breaker
+    dates = ['2024-03-01', '2024-03-02', '2024-03-01', '2024-03-02', '2024-03-01']
+    import_expenses(group, [{'description': f'Coffee {n}', 'amount': 4, 'paid_by': 1, 'split_members': [1, 2],
+                             'date': date} for n, date in enumerate(dates, start=1)])
+    login(client, 2)
+
+    assert walk(client, f'/group/{group}/expenses', limit=2) == [[4, 2], [5, 3], [1]]
+    assert walk(client, f'/group/{group}/expenses/search', q='coffee', limit=3) == [[4, 2, 5], [3, 1]]
+
+
+def test_page_size_and_cursor_are_validated(client, group):
+    import_expenses(group, [{'description': 'Tea', 'amount': 2, 'paid_by': 1, 'split_members': [1, 2]}] * 3)
+    login(client, 1)
+
+    for url in (f'/group/{group}/expenses', f'/group/{group}/expenses/search'):
+        assert len(client.get(url, query_string={'limit': -2}).get_json()['expenses']) == 1
+        assert len(client.get(url, query_string={'limit': 500}).get_json()['expenses']) == 3
+        response = client.get(url, query_string={'cursor': 'not-a-cursor'})
+        assert response.status_code == 400
+        assert response.get_json()['success'] is False
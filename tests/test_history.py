@@ -0,0 +1,86 @@
+"""Balance checkpoints and archived history."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, text
+
+from app import (ArchivedExpense, ArchivedExpenseShare, ArchivedSettlement, Expense, ExpenseShare,
+                 archive_group_history, calculate_group_balances, create_balance_checkpoint,
+                 create_search_index, db, rebuild_group_ledger, tables_reusing_ids)
+from tests.conftest import add_expense, login
+
+
+def checkpoint_everything(group_id):
+    return create_balance_checkpoint(group_id, datetime.utcnow() + timedelta(days=1))
+
+
+def test_archiving_moves_history_and_keeps_balances(app, client, group):
+    login(client, 1)
+    for amount in (9.0, 12.0, 3.3):
+        add_expense(client, group, amount, 2, [1, 2, 3])
+    response = client.post('/mark-settled', json={'group_id': group, 'from_user': 1, 'to_user': 2, 'amount': 5})
+    assert response.get_json() == {'success': True}
+    balances = calculate_group_balances(group)
+
+    checkpoint_everything(group)
+    # Batches smaller than the history, with foreign keys enforced by the fixture
+    assert archive_group_history(group, batch_size=2) == (3, 1)
+
+    assert db.session.query(Expense).count() == db.session.query(ExpenseShare).count() == 0
+    assert db.session.query(ArchivedExpense).count() == 3
+    assert db.session.query(ArchivedExpenseShare).count() == 9
+    assert db.session.query(ArchivedSettlement).count() == 1
+    assert rebuild_group_ledger(group, fix=False) == []
+    assert calculate_group_balances(group) == balances
+
+
+def test_expenses_added_after_archiving_get_new_ids(app, client, group):
+    login(client, 1)
+    archived_id = add_expense(client, group, 9.0, 2, [1, 2, 3])
+    checkpoint = checkpoint_everything(group)
+    assert archive_group_history(group) == (1, 0)
+
+    expense_id = add_expense(client, group, 0.3, 1, [2])
+    assert expense_id > checkpoint.expense_id >= archived_id
+    result = app.test_cli_runner().invoke(args=['rebuild-ledger', '--verify-only'])
+    assert result.exit_code == 0, result.output
+    assert calculate_group_balances(group) == {1: -2.7, 2: 5.7, 3: -3.0}
+
+    # Still live history, so it can be deleted
+    assert client.post(f'/delete-expense/{expense_id}').get_json()['success']
+    assert rebuild_group_ledger(group, fix=False) == []
+
+
+def make_legacy_table(name):
+    """Recreate an empty table the way create_all made it before AUTOINCREMENT"""
+    sql = db.session.execute(text('SELECT sql FROM sqlite_master WHERE name = :name'), {'name': name}).scalar()
+    db.session.execute(text(f'DROP TABLE {name}'))
+    db.session.execute(text(sql.replace('AUTOINCREMENT', '')))
+    db.session.commit()
+
+
+def test_init_db_rebuilds_tables_that_reuse_ids(app, client, group):
+    make_legacy_table('expense')
+    make_legacy_table('settlement')
+    create_search_index()
+    assert tables_reusing_ids() == ['expense', 'settlement']
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['archive-history', '--group', str(group)])
+    assert result.exit_code != 0
+    assert 'expense, settlement reuse deleted ids' in result.output
+
+    login(client, 1)
+    kept_id = add_expense(client, group, 9.0, 2, [1, 2, 3])
+    # An expense archived before the upgrade still holds its id
+    db.session.add(ArchivedExpense(id=50, group_id=group, description='Old', amount=1, paid_by=1, split_members='1'))
+    db.session.commit()
+
+    result = runner.invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert tables_reusing_ids() == []
+    assert db.session.get(Expense, kept_id).shares
+    assert add_expense(client, group, 3.0, 1, [1, 2]) > 50
+    assert {index['name'] for index in inspect(db.engine).get_indexes('expense')} >= {'ix_expense_group_date_id'}
+    hits = client.get(f'/group/{group}/expenses/search', query_string={'q': 'dinner'}).get_json()['expenses']
+    assert len(hits) == 2
+    assert rebuild_group_ledger(group, fix=False) == []
@@ -0,0 +1,56 @@
+"""Idempotency-Key replay on expense and settlement writes."""
+from app import Expense, IdempotencyKey, Settlement, calculate_group_balances, db
+from tests.conftest import login
+
+
+def post_expense(client, group_id, key, amount=9.0):
+    return client.post(f'/add-expense/{group_id}', headers={'Idempotency-Key': key}, json={
+        'description': 'Dinner', 'amount': amount, 'paid_by': 1, 'split_members': [1, 2, 3]})
+
+
+def test_retried_expense_is_written_once_and_replayed(client, group):
+    login(client, 1)
+    first = post_expense(client, group, 'retry-1')
+    retry = post_expense(client, group, 'retry-1')
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert db.session.query(Expense).count() == 1
+    assert calculate_group_balances(group) == {1: 6.0, 2: -3.0, 3: -3.0}
+
+
+def test_a_key_reused_for_a_different_request_is_rejected(client, group):
+    login(client, 1)
+    assert post_expense(client, group, 'retry-2').status_code == 200
+    response = post_expense(client, group, 'retry-2', amount=12.0)
+    assert response.status_code == 422
+    assert db.session.query(Expense).count() == 1
+
+    # The key belongs to add_expense, so a settlement can't reuse it either
+    response = client.post('/mark-settled', headers={'Idempotency-Key': 'retry-2'},
+                           json={'group_id': group, 'from_user': 2, 'to_user': 1, 'amount': 3})
+    assert response.status_code == 422
+    assert db.session.query(Settlement).count() == 0
+
+
+def test_keys_are_per_user_and_bounded(client, group):
+    login(client, 1)
+    assert post_expense(client, group, 'shared').status_code == 200
+    login(client, 2)
+    assert 'Idempotent-Replayed' not in post_expense(client, group, 'shared').headers
+    assert db.session.query(Expense).count() == 2
+    assert db.session.query(IdempotencyKey).count() == 2
+
+    assert post_expense(client, group, 'k' * 65).status_code == 400
+
+
+def test_failed_writes_do_not_store_the_key(client, group):
+    login(client, 1)
+    body = {'group_id': group, 'from_user': 2, 'to_user': 2, 'amount': 3}
+    assert client.post('/mark-settled', headers={'Idempotency-Key': 'settle'}, json=body).status_code == 400
+    body['to_user'] = 1
+    response = client.post('/mark-settled', headers={'Idempotency-Key': 'settle'}, json=body)
+    assert response.get_json() == {'success': True}
+    assert db.session.query(IdempotencyKey).count() == 1
@@ -0,0 +1,44 @@
+"""Bulk expense import."""
+import pytest
+
+from app import (Expense, ExpenseShare, Group, calculate_group_balances, db, import_expenses,
+                 rebuild_group_ledger)
+from tests.conftest import login
+
+RECORDS = [
+    {'description': 'Taxi', 'amount': 30, 'paid_by': 1, 'split_members': [1, 2, 3]},
+    {'description': 'Museum', 'amount': '12.50', 'paid_by': 2, 'split_members': '1;2'},
+    {'description': 'Lunch', 'amount': 10, 'paid_by': 3, 'split_members': [3, 1], 'date': '2024-03-01'},
+    {'description': 'Hotel', 'amount': 100, 'paid_by': 3, 'split_members': [1, 2, 3]},
+    {'description': 'Snacks', 'amount': 1, 'paid_by': 2, 'split_members': [2]},
+]
+
+
+def test_import_writes_every_batch_with_matching_shares(app, group):
+    assert import_expenses(group, RECORDS, batch_size=2) == (5, [])
+
+    expenses = db.session.query(Expense).order_by(Expense.id).all()
+    assert [expense.description for expense in expenses] == [record['description'] for record in RECORDS]
+    for expense in expenses:
+        assert [share.user_id for share in expense.shares] == [int(x) for x in expense.split_members.split(',')]
+        assert sum(share.share_amount for share in expense.shares) == pytest.approx(expense.amount)
+    assert db.session.query(ExpenseShare).count() == 11
+
+    group_row = db.session.get(Group, group)
+    assert (group_row.expense_count, group_row.total_spent) == (5, 153.5)
+    assert rebuild_group_ledger(group, fix=False) == []
+
+
+def test_import_reports_bad_rows_and_strict_imports_nothing(client, group):
+    login(client, 1)
+    records = RECORDS[:2] + [{'description': 'Gift', 'amount': 5, 'paid_by': 9, 'split_members': [1]},
+                             {'description': '', 'amount': 5, 'paid_by': 1, 'split_members': [1]}]
+    response = client.post(f'/group/{group}/expenses/bulk?strict=1', json=records)
+    assert response.get_json() == {'success': False, 'imported': 0, 'errors': [
+        {'row': 3, 'message': 'Payer 9 is not a member of this group'},
+        {'row': 4, 'message': 'Description is required'}]}
+    assert db.session.query(Expense).count() == 0
+
+    response = client.post(f'/group/{group}/expenses/bulk', json=records)
+    assert response.get_json()['imported'] == 2
+    assert calculate_group_balances(group) == pytest.approx({1: 13.75, 2: -3.75, 3: -10.0})
@@ -0,0 +1,66 @@
+"""Expense and settlement writes and the balance ledger they maintain."""
+import pytest
+
+from app import (MemberBalance, Settlement, apply_balance_deltas, calculate_group_balances, db,
+                 rebuild_group_ledger, replay_group_balances)
+from tests.conftest import add_expense, login
+
+
+def ledger_rows(group_id):
+    return sorted(db.session.query(MemberBalance.user_id, MemberBalance.balance).filter_by(group_id=group_id))
+
+
+def test_balance_deltas_insert_missing_rows_and_add_to_existing_ones(app, group):
+    apply_balance_deltas(group, {1: 10.0, 2: -10.0})
+    db.session.commit()
+    apply_balance_deltas(group, {2: 4.0, 3: -4.0})
+    db.session.commit()
+    assert ledger_rows(group) == [(1, 10.0), (2, -6.0), (3, -4.0)]
+
+
+def test_writes_keep_the_ledger_equal_to_a_replay(client, group):
+    login(client, 1)
+    add_expense(client, group, 10.0, 1, [1, 2, 3])
+    expense_id = add_expense(client, group, 7.5, 2, [1, 3])
+    response = client.post('/mark-settled', json={'group_id': group, 'from_user': 3, 'to_user': 1, 'amount': 2.5})
+    assert response.get_json() == {'success': True}
+
+    balances = calculate_group_balances(group)
+    assert balances == pytest.approx(replay_group_balances(group))
+    assert balances == pytest.approx({1: 0.41, 2: 4.17, 3: -4.58})
+
+    assert client.post(f'/delete-expense/{expense_id}').get_json()['success']
+    assert calculate_group_balances(group) == pytest.approx({1: 4.16, 2: -3.33, 3: -0.83})
+    assert calculate_group_balances(group) == pytest.approx(replay_group_balances(group))
+
+
+@pytest.mark.parametrize('group_id', [None, 'abc', [1]])
+def test_settlements_need_a_group_id(client, group, group_id):
+    login(client, 1)
+    response = client.post('/mark-settled', json={'group_id': group_id, 'from_user': 1, 'to_user': 2, 'amount': 5})
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'message': 'Invalid settlement'}
+    assert db.session.query(Settlement).count() == 0
+
+
+def test_rebuilding_reports_and_repairs_drift(group, client):
+    login(client, 1)
+    add_expense(client, group, 9.0, 1, [1, 2, 3])
+    MemberBalance.query.filter_by(group_id=group, user_id=2).update({'balance': -1.0})
+    db.session.commit()
+
+    assert rebuild_group_ledger(group, fix=False) == [(2, -1.0, -3.0)]
+    assert rebuild_group_ledger(group) == [(2, -1.0, -3.0)]
+    assert ledger_rows(group) == [(1, 6.0), (2, -3.0), (3, -3.0)]
+    assert rebuild_group_ledger(group, fix=False) == []
+
+
+def test_rebuilding_skips_members_who_left(group, client):
+    login(client, 3)
+    add_expense(client, group, 9.0, 2, [2, 3])
+    response = client.post('/mark-settled', json={'group_id': group, 'from_user': 3, 'to_user': 2, 'amount': 4.5})
+    assert response.get_json() == {'success': True}
+    assert client.post(f'/group/{group}/leave').get_json()['success']
+
+    assert rebuild_group_ledger(group) == []
+    assert ledger_rows(group) == [(2, 0.0)]
@@ -0,0 +1,67 @@
+"""The pairwise debt index behind cross-group positions."""
+import random
+
+import pytest
+
+from app import PairwiseBalance, db, expense_pair_deltas, fold_pairs, get_user_positions, mirror_pairs
+from tests.conftest import add_expense, login
+
+
+def test_expense_pair_deltas_skip_the_payers_own_share():
+    assert expense_pair_deltas(1, [(1, 10.0), (2, 10.0), (3, 10.0)]) == {(1, 2): 10.0, (1, 3): 10.0}
+    assert expense_pair_deltas(1, [(2, 5.0)], sign=-1) == {(1, 2): -5.0}
+
+
+def test_mirror_pairs_store_both_sides():
+    mirrored = mirror_pairs({(1, 2): 10.0, (2, 1): 4.0, (3, 3): 7.0, (1, 4): 0})
+    assert mirrored == {(1, 2): 6.0, (2, 1): -6.0}
+
+
+def test_folding_a_leaving_member_keeps_everyone_elses_position():
+    # Member 1 is owed 30 by member 2 and owes 20 to member 3 and 10 to member 4
+    positions = {2: 30.0, 3: -20.0, 4: -10.0}
+    folded = fold_pairs(1, positions)
+    assert folded == {(3, 2): 20.0, (4, 2): 10.0}
+
+    totals = {}
+    for (user_id, _), amount in mirror_pairs(folded).items():
+        totals[user_id] = totals.get(user_id, 0) + amount
+    # Each remaining member's net is what it was against the member who left
+    assert totals == {counterparty: -amount for counterparty, amount in positions.items()}
+
+
+def test_folding_random_positions_conserves_money():
+    rng = random.Random(3)
+    for _ in range(200):
+        amounts = [rng.randint(-5000, 5000) / 100 for _ in range(rng.randint(1, 8))]
+        amounts.append(-round(sum(amounts), 2))
+        positions = {counterparty: amount for counterparty, amount in enumerate(amounts, start=2) if amount}
+        totals = {}
+        for (user_id, _), amount in mirror_pairs(fold_pairs(1, positions)).items():
+            totals[user_id] = totals.get(user_id, 0) + amount
+        for counterparty, amount in positions.items():
+            assert totals.get(counterparty, 0) == pytest.approx(-amount, abs=0.01)
+
+
+def pair_rows(group_id):
+    return {(row.user_id, row.counterparty_id): row.amount
+            for row in PairwiseBalance.query.filter_by(group_id=group_id) if round(row.amount, 2)}
+
+
+def test_pairs_follow_writes_and_fold_when_a_member_leaves(client, group):
+    login(client, 2)
+    add_expense(client, group, 6.0, 1, [2])
+    add_expense(client, group, 6.0, 2, [3])
+    assert pair_rows(group) == {(1, 2): 6.0, (2, 1): -6.0, (2, 3): 6.0, (3, 2): -6.0}
+
+    # User 2 is at zero overall, so leaving folds "3 owes 2 owes 1" into "3 owes 1"
+    assert client.post(f'/group/{group}/leave').get_json()['success']
+    assert pair_rows(group) == {(1, 3): 6.0, (3, 1): -6.0}
+    positions = get_user_positions(3)
+    assert (positions['owed_to_you'], positions['you_owe'], positions['net']) == (0, 6.0, -6.0)
+    assert [(person['user_id'], person['net']) for person in positions['counterparties']] == [(1, -6.0)]
+
+    login(client, 3)
+    response = client.post('/mark-settled', json={'group_id': group, 'from_user': 3, 'to_user': 1, 'amount': 6})
+    assert response.get_json() == {'success': True}
+    assert pair_rows(group) == {}
@@ -0,0 +1,79 @@
+"""Settlement plans and cent rounding."""
+import random
+from itertools import combinations
+
+import pytest
+
+from settlement_engine import greedy_transfers, optimal_transfers, plan_settlements, to_cents
+
+
+def random_cents(rng, n):
+    amounts = [rng.randint(-5000, 5000) for _ in range(n - 1)]
+    amounts.append(-sum(amounts))
+    return {user_id: amount for user_id, amount in enumerate(amounts, start=1) if amount}
+
+
+def settle(cents, transfers):
+    """Apply transfers to balances and return what is left"""
+    left = dict(cents)
+    for debtor, creditor, amount in transfers:
+        assert amount > 0
+        left[debtor] += amount
+        left[creditor] -= amount
+    return left
+
+
+def max_zero_sum_groups(amounts):
+    """Brute force: the most disjoint zero-sum groups the amounts split into"""
+    if not amounts:
+        return 0
+    first, rest = amounts[0], amounts[1:]
+    best = 0
+    for size in range(len(rest) + 1):
+        for others in combinations(range(len(rest)), size):
+            if first + sum(rest[i] for i in others) == 0:
+                remaining = [amount for i, amount in enumerate(rest) if i not in others]
+                best = max(best, 1 + max_zero_sum_groups(remaining))
+    return best
+
+
+def test_to_cents_gives_the_residual_cent_to_the_largest_balance():
+    cents = to_cents({1: 0.333, 2: 0.333, 3: -0.666})
+    assert sum(cents.values()) == 0
+    assert cents == {1: 33, 2: 33, 3: -66}
+
+
+def test_to_cents_drops_settled_members():
+    assert to_cents({1: 10.0, 2: -10.0, 3: 0.001}) == {1: 1000, 2: -1000}
+
+
+@pytest.mark.parametrize('strategy', ['optimal', 'greedy'])
+def test_plans_settle_everyone_exactly(strategy):
+    rng = random.Random(7)
+    for _ in range(200):
+        cents = random_cents(rng, rng.randint(2, 12))
+        plan = plan_settlements({user_id: amount / 100 for user_id, amount in cents.items()}, strategy=strategy)
+        transfers = [(item['from_user'], item['to_user'], round(item['amount'] * 100)) for item in plan]
+        assert all(abs(item['amount'] * 100 - round(item['amount'] * 100)) < 1e-6 for item in plan)
+        assert not any(settle(cents, transfers).values())
+        assert len(transfers) <= max(len(cents) - 1, 0)
+
+
+def test_optimal_plan_uses_the_fewest_transfers():
+    rng = random.Random(11)
+    for _ in range(100):
+        cents = random_cents(rng, rng.randint(2, 7))
+        # Build in some zero-sum subgroups so there is something to find
+        cents.update({100: 250, 101: -100, 102: -150})
+        transfers = optimal_transfers(cents)
+        assert not any(settle(cents, transfers).values())
+        assert len(transfers) == len(cents) - max_zero_sum_groups(list(cents.values()))
+
+
+def test_greedy_transfers_match_largest_first():
+    assert greedy_transfers({1: 500, 2: -300, 3: -200}) == [(2, 1, 300), (3, 1, 200)]
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        plan_settlements({1: 1.0, 2: -1.0}, strategy='fastest')
@@ -0,0 +1,90 @@
+"""Group commit: run concurrent writes in shared transactions.
+
+Each commit on SQLite takes the database's single write lock and flushes the
+WAL, so many small transactions queue up behind one another. A
+:class:`WriteCoalescer` funnels write functions through one committer thread
+that gathers whatever arrives within a short window and hands the lot to a
+single transaction. Callers block until that transaction has committed, so
+they never acknowledge a write that could still be lost.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from jobs import QueueFull
+
+logger = logging.getLogger(__name__)
+
+
+class WriteCoalescer:
+    """Batch write functions submitted from many threads.
+
+    ``run_batch`` is called on the committer thread with a list of
+    functions and must return one ``(ok, result_or_exception)`` pair per
+    function, committing as it sees fit. A batch is closed ``window``
+    seconds after its first function arrives or once it holds
+    ``max_batch`` of them. Beyond ``max_pending`` waiting functions
+    :class:`jobs.QueueFull` is raised.
+    """
+
+    def __init__(self, run_batch, window=0.005, max_batch=64, max_pending=256):
+        self.window = window
+        self.max_batch = max_batch
+        self._run_batch = run_batch
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._commit_forever, name='write-coalescer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        """Run ``fn`` in the next batch and return its result once committed"""
+        future = Future()
+        try:
+            self._queue.put_nowait((fn, future))
+        except queue.Full:
+            raise QueueFull('Write queue is full')
+        return future.result()
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _commit_forever(self):
+        while not self._stopping:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                outcomes = self._run_batch([fn for fn, _ in batch])
+            except Exception as e:
+                logger.exception('Write batch failed')
+                outcomes = [(False, e)] * len(batch)
+            for (_, future), (ok, value) in zip(batch, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _collect(self):
+        item = self._queue.get()
+        if item is None:
+            self._stopping = True
+            return []
+        batch = [item]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._stopping = True
+                break
+            batch.append(item)
+        return batch